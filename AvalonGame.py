@@ -1,50 +1,160 @@
+from collections import namedtuple
+from enum import IntFlag
 import random
 
+class Role(IntFlag):
+    MORDRED = 1
+    MORGANA = 2
+    ASSASSIN = 4
+    OBERON = 8
+    MINION = 16
+    MERLIN = 32
+    PERCIVAL = 64
+    KNIGHT = 128
+
+ROLE_BY_NAME = {
+    "Mordred": Role.MORDRED,
+    "Morgana": Role.MORGANA,
+    "Assassin": Role.ASSASSIN,
+    "Oberon": Role.OBERON,
+    "Minion": Role.MINION,
+    "Merlin": Role.MERLIN,
+    "Percival": Role.PERCIVAL,
+    "Knight": Role.KNIGHT
+}
+NAME_BY_ROLE = {role: name for name, role in ROLE_BY_NAME.items()}
+
+GOOD_ROLES = Role.MERLIN | Role.PERCIVAL | Role.KNIGHT
+EVIL_ROLES_NOOB = Role.MORGANA | Role.MORDRED | Role.ASSASSIN | Role.MINION
+
+# Roles each character can see; noob evil see each other but not others with their own role
+ROLE_SIGHT = {
+    Role.MERLIN: Role.MORGANA | Role.ASSASSIN | Role.OBERON | Role.MINION,
+    Role.PERCIVAL: Role.MERLIN | Role.MORGANA,
+    Role.MORGANA: EVIL_ROLES_NOOB & ~Role.MORGANA,
+    Role.MORDRED: EVIL_ROLES_NOOB & ~Role.MORDRED,
+    Role.ASSASSIN: EVIL_ROLES_NOOB & ~Role.ASSASSIN,
+    Role.MINION: EVIL_ROLES_NOOB & ~Role.MINION
+}
+
+# Shared by every game with the same player count, so never mutate these
+MISSION_PARTICIPANTS = {
+    5: (2, 3, 2, 3, 3),
+    6: (2, 3, 4, 3, 4),
+    7: (2, 3, 3, 4, 4),
+    8: (3, 4, 4, 5, 5),
+    9: (3, 4, 4, 5, 5),
+    10: (3, 4, 4, 5, 5)
+}
+
+FAILS_REQUIRED_SMALL = (1, 1, 1, 1, 1)
+FAILS_REQUIRED_LARGE = (1, 1, 1, 2, 1)
+
+DEFAULT_CHARACTERS = {
+    5: ("Morgana", "Assassin", "Merlin", "Percival", "Knight"),
+    6: ("Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight"),
+    7: ("Mordred", "Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight"),
+    8: ("Mordred", "Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight", "Knight"),
+    9: ("Mordred", "Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight", "Knight", "Knight"),
+    10: ("Mordred", "Morgana", "Assassin", "Oberon", "Merlin", "Percival", "Knight", "Knight", "Knight", "Knight")
+}
+
+# Log entries are compact typed events. player is an index into players, mask
+# is a bitmask over player indices (the team, or the yes votes) and count is
+# the number of fails. log_lines() renders them to text.
+LogEvent = namedtuple('LogEvent', ('kind', 'player', 'mask', 'count'))
+
+LOG_PROPOSED = 0
+LOG_REJECTED = 1
+LOG_APPROVED = 2
+LOG_MISSION_PASSED = 3
+LOG_MISSION_FAILED = 4
+LOG_EVIL_REJECTIONS = 5
+LOG_EVIL_MISSIONS = 6
+LOG_GOOD_WINS = 7
+LOG_EVIL_ASSASSINATION = 8
+
+ENDING_TEXT = {
+    LOG_EVIL_REJECTIONS: "Evil team wins via rejections.",
+    LOG_EVIL_MISSIONS: "Evil team wins via missions",
+    LOG_GOOD_WINS: "Good team wins",
+    LOG_EVIL_ASSASSINATION: "Evil team wins via assassination"
+}
+
+# Every accepted action is kept in AvalonGame.actions as three bytes:
+# kind << 4 | player index, then a 16-bit value (team bitmask, 0/1, or target index)
+ACTION_PROPOSE = 0
+ACTION_VOTE = 1
+ACTION_MISSION = 2
+ACTION_ASSASSINATE = 3
+ACTION_SIZE = 3
+ACTION_METHODS = {
+    ACTION_PROPOSE: 'propose_team',
+    ACTION_VOTE: 'player_vote',
+    ACTION_MISSION: 'player_mission_act',
+    ACTION_ASSASSINATE: 'assassination'
+}
+
+# Seeds fit a signed 64-bit column
+SEED_BITS = 63
+
+DERIVED_SLOTS = ('player_index', 'role_mask', 'visibility', 'mission_participants', 'fails_required', 'log_text')
+
+def decode_actions(players, actions):
+    # Yields (kind, player name, argument) in the form AvalonGame's methods take
+    for i in range(0, len(actions), ACTION_SIZE):
+        kind, player = actions[i] >> 4, actions[i] & 0xF
+        value = actions[i + 1] | actions[i + 2] << 8
+        if kind == ACTION_PROPOSE:
+            argument = [name for j, name in enumerate(players) if value >> j & 1]
+        elif kind == ACTION_ASSASSINATE:
+            argument = players[value]
+        else:
+            argument = bool(value)
+        yield kind, players[player], argument
+
 class AvalonGame:
-    def __init__(self, players, roles=None):
+    __slots__ = (
+        'players', 'player_index', 'roles', 'role_mask', 'visibility', 'turn_indices',
+        'characters', 'mission_participants', 'fails_required',
+        'current_turn', 'completed_missions', 'consecutive_rejects', 'proposed_team',
+        'votes', 'mission_actions', 'mechanic_mode', 'winner', 'log', 'log_text', 'actions', 'seed', 'version'
+    )
+
+    def __init__(self, players, roles=None, seed=None):
         if len(players) not in [5, 6, 7, 8, 9, 10]:
             raise ValueError("Must have between 5 and 10 players.")
-        
+
         if len(players) != len(set(players)):
             raise ValueError("Players must be unique.")
-        
+
         if roles is not None:
             if len(roles) != len(players):
                 raise ValueError("Roles must be None or a list of length equal to players.")
-            if any([c not in ["Mordred", "Morgana", "Assassin", "Oberon", "Minion", "Merlin", "Percival", "Knight"] for c in roles]):
+            if any([c not in ROLE_BY_NAME for c in roles]):
                 raise ValueError("Unrecognized roles.")
-        
-        self.mission_participants = {
-            5: [2, 3, 2, 3, 3],
-            6: [2, 3, 4, 3, 4],
-            7: [2, 3, 3, 4, 4],
-            8: [3, 4, 4, 5, 5],
-            9: [3, 4, 4, 5, 5],
-            10: [3, 4, 4, 5, 5]
-        }[len(players)]
+
+        self.mission_participants = MISSION_PARTICIPANTS[len(players)]
 
         if len(players) <= 6:
-            self.fails_required = [1, 1, 1, 1, 1]
+            self.fails_required = FAILS_REQUIRED_SMALL
         else:
-            self.fails_required = [1, 1, 1, 2, 1]
+            self.fails_required = FAILS_REQUIRED_LARGE
 
         if roles is None:
-            self.characters = {
-                5: ["Morgana", "Assassin", "Merlin", "Percival", "Knight"],
-                6: ["Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight"],
-                7: ["Mordred", "Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight"],
-                8: ["Mordred", "Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight", "Knight"],
-                9: ["Mordred", "Morgana", "Assassin", "Merlin", "Percival", "Knight", "Knight", "Knight", "Knight"],
-                10: ["Mordred", "Morgana", "Assassin", "Oberon", "Merlin", "Percival", "Knight", "Knight", "Knight", "Knight"]
-            }[len(players)]
+            self.characters = DEFAULT_CHARACTERS[len(players)]
         else:
-            self.characters = roles
-
-        # Assign characters to players
-        self.player_characters = {player: character for player, character in zip(players, random.sample(self.characters, len(players)))}
+            self.characters = tuple(roles)
 
-        # Shuffle players to determine turn order
-        self.turn_order = random.sample(players, len(players))
+        # Assign characters to players and shuffle players to determine turn order.
+        # The game's own generator makes the deal reproducible from its seed.
+        if seed is None:
+            seed = random.getrandbits(SEED_BITS)
+        self.seed = seed
+        rng = random.Random(seed)
+        assigned = rng.sample(self.characters, len(players))
+        turn_order = rng.sample(players, len(players))
+        self._assign(players, [ROLE_BY_NAME[c] for c in assigned], turn_order)
         self.current_turn = 0
 
         # Game state variables
@@ -56,100 +166,254 @@ class AvalonGame:
         self.mechanic_mode = "proposal"
         self.winner = ""
         self.log = []
+        self.log_text = []
+        self.actions = bytearray()
+        # Bumped on every mutation so rendered pages can be cached per version
+        self.version = 0
+
+    @classmethod
+    def replay(cls, seed, players, roles, actions):
+        # Rebuilds a game from its seed and recorded actions (the bytes in .actions)
+        this_game = cls(players, roles, seed)
+        for kind, player_name, argument in decode_actions(this_game.players, actions):
+            getattr(this_game, ACTION_METHODS[kind])(player_name, argument)
+        return this_game
+
+    def _assign(self, players, roles, turn_order):
+        # Players are referred to by their index in self.players from here on
+        self.players = tuple(players)
+        self.player_index = {player: i for i, player in enumerate(self.players)}
+        self.roles = tuple(Role(role) for role in roles)
+        self.role_mask = Role(0)
+        for role in self.roles:
+            self.role_mask |= role
+        self.turn_indices = tuple(self.player_index[player] for player in turn_order)
+
+        # visibility[i] is a bitmask of the player indices player i knows, or None if they know nobody
+        visibility = []
+        for role in self.roles:
+            sight = ROLE_SIGHT.get(role)
+            if sight is None:
+                visibility.append(None)
+            else:
+                visibility.append(sum(1 << j for j, other in enumerate(self.roles) if other & sight))
+        self.visibility = tuple(visibility)
+
+    @property
+    def player_characters(self):
+        return {player: NAME_BY_ROLE[role] for player, role in zip(self.players, self.roles)}
+
+    @player_characters.setter
+    def player_characters(self, player_characters):
+        roles = [ROLE_BY_NAME[c] for c in player_characters.values()]
+        self._assign(list(player_characters), roles, self.turn_order)
+        # A deal set by hand can't be reproduced from the seed
+        self.seed = None
+
+    @property
+    def turn_order(self):
+        return [self.players[i] for i in self.turn_indices]
+
+    @turn_order.setter
+    def turn_order(self, turn_order):
+        self.turn_indices = tuple(self.player_index[player] for player in turn_order)
+        self.seed = None
+
+    def __getstate__(self):
+        # Derived lookups and the shared tables are rebuilt on load rather than pickled
+        state = {name: getattr(self, name) for name in self.__slots__ if name not in DERIVED_SLOTS}
+        state['roles'] = tuple(int(role) for role in self.roles)
+        state['log'] = [tuple(event) for event in self.log]
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        players = state.pop('players')
+        self._assign(players, state.pop('roles'), [players[i] for i in state.pop('turn_indices')])
+        self.mission_participants = MISSION_PARTICIPANTS[len(players)]
+        self.fails_required = FAILS_REQUIRED_SMALL if len(players) <= 6 else FAILS_REQUIRED_LARGE
+        for name, value in state.items():
+            if name not in DERIVED_SLOTS:
+                setattr(self, name, value)
+        self.log = [LogEvent(*event) for event in self.log]
+        self.log_text = []
+
+    def clone(self, roles=None):
+        # Shares the immutable parts and copies only the mutable state, for search and rollouts.
+        # Passing roles (one per player) gives a copy with those hidden roles instead.
+        other = AvalonGame.__new__(AvalonGame)
+        other.players = self.players
+        other.characters = self.characters
+        other.mission_participants = self.mission_participants
+        other.fails_required = self.fails_required
+        if roles is None:
+            other.player_index = self.player_index
+            other.roles = self.roles
+            other.role_mask = self.role_mask
+            other.visibility = self.visibility
+            other.turn_indices = self.turn_indices
+        else:
+            other._assign(self.players, roles, self.turn_order)
+        other.current_turn = self.current_turn
+        other.completed_missions = list(self.completed_missions)
+        other.consecutive_rejects = self.consecutive_rejects
+        other.proposed_team = list(self.proposed_team)
+        other.votes = dict(self.votes)
+        other.mission_actions = dict(self.mission_actions)
+        other.mechanic_mode = self.mechanic_mode
+        other.winner = self.winner
+        other.log = list(self.log)
+        other.actions = bytearray(self.actions)
+        other.seed = self.seed
+        # Rendered lazily, and copies made for search never render
+        other.log_text = []
+        other.version = self.version
+        return other
+
+    def _record(self, kind, player_name, value):
+        self.actions += bytes((kind << 4 | self.player_index[player_name], value & 0xFF, value >> 8))
+
+    def _rerecord_vote(self, player_name, vote):
+        # This round's votes are the last few actions, so the first match from the end is the one to change
+        code = ACTION_VOTE << 4 | self.player_index[player_name]
+        for i in range(len(self.actions) - ACTION_SIZE, -1, -ACTION_SIZE):
+            if self.actions[i] == code:
+                self.actions[i + 1] = 1 if vote else 0
+                return
+
+    def _mask(self, player_names):
+        mask = 0
+        for player in player_names:
+            mask |= 1 << self.player_index[player]
+        return mask
+
+    def _names(self, mask):
+        return [player for i, player in enumerate(self.players) if mask >> i & 1]
+
+    def render_log_event(self, event):
+        if event.kind == LOG_PROPOSED:
+            return f"{self.players[event.player]} proposed {self._names(event.mask)}"
+        if event.kind == LOG_REJECTED:
+            return f"rejected by {self._names(((1 << len(self.players)) - 1) & ~event.mask)}"
+        if event.kind == LOG_APPROVED:
+            return f"approved by {self._names(event.mask)}"
+        if event.kind in (LOG_MISSION_PASSED, LOG_MISSION_FAILED):
+            return f"mission {'passed' if event.kind == LOG_MISSION_PASSED else 'failed'} with {event.count} fails"
+        return ENDING_TEXT[event.kind]
+
+    def log_lines(self, start=0, stop=None):
+        # log_text is a sparse cache: only events inside a requested window are
+        # rendered, so a game unpickled from sqlite or redis (where the cache
+        # starts empty) renders just the lines asked for. Slice assignment keeps
+        # the cache aligned if two readers grow it at once.
+        rendered = len(self.log_text)
+        self.log_text[rendered:len(self.log)] = [None] * (len(self.log) - rendered)
+        window = range(len(self.log))[start:stop]
+        for i in window:
+            if self.log_text[i] is None:
+                self.log_text[i] = self.render_log_event(self.log[i])
+        return [self.log_text[i] for i in window]
 
     def get_game_params(self):
         return {
             "turn order:": self.turn_order,
-            "mission_participants": self.mission_participants,
-            "fails_required": self.fails_required,
-            "characters": self.characters
+            "mission_participants": list(self.mission_participants),
+            "fails_required": list(self.fails_required),
+            "characters": list(self.characters)
         }
 
     def get_game_state(self):
         return {
             "completed_missions": self.completed_missions,
             "consecutive_rejects": self.consecutive_rejects,
-            "current_turn": self.turn_order[self.current_turn],
+            "current_turn": self.players[self.turn_indices[self.current_turn]],
             "current_mechanic_mode": self.mechanic_mode,
             "proposed_team": self.proposed_team
         }
-    
+
     def get_game_results(self):
         if self.mechanic_mode != "ended":
             raise ValueError("Game must have ended to see results.")
         return {
             "winner": self.winner,
             "player_characters": self.player_characters,
-            "log": self.log
+            "log": self.log_lines()
         }
 
     def get_player_known_info(self, player_name):
         # Check if the player is in the game
-        if player_name not in self.player_characters:
+        index = self.player_index.get(player_name)
+        if index is None:
             raise ValueError(f"Player not found in the game")
 
-        character = self.player_characters[player_name]
-        info = {'character': character}
-        
-        evil_roles_noob = ["Morgana", "Mordred", "Assassin", "Minion"]
+        info = {'character': NAME_BY_ROLE[self.roles[index]]}
 
         # Providing information based on the character
-        if character == "Merlin":
-            info['known_players'] = [player for player, role in self.player_characters.items() if role in ["Morgana", "Assassin", "Oberon", "Minion"]]
-        elif character == "Percival":
-            info['known_players'] = [player for player, role in self.player_characters.items() if role in ["Merlin", "Morgana"]]
-        elif character in evil_roles_noob:
-            evil_roles_noob.remove(character)
-            info['known_players'] = [player for player, role in self.player_characters.items() if role in evil_roles_noob]
+        known = self.visibility[index]
+        if known is not None:
+            info['known_players'] = [player for j, player in enumerate(self.players) if known >> j & 1]
 
         return info
-    
+
     def propose_team(self, player_name, team):
         if self.mechanic_mode != "proposal":
             raise ValueError("It is not time for mission proposal.")
-        
-        if player_name != self.turn_order[self.current_turn]:
+
+        if self.player_index.get(player_name) != self.turn_indices[self.current_turn]:
             raise ValueError("It is a different player's turn.")
 
         if len(team) != self.mission_participants[len(self.completed_missions)]:
             raise ValueError(f"Proposed team must have {self.mission_participants[len(self.completed_missions)]} members.")
 
-        if not all(player in self.turn_order for player in team):
+        if not all(player in self.player_index for player in team):
             raise ValueError("All players in the proposed team must be part of the game.")
 
-        self.proposed_team = team
+        if len(set(team)) != len(team):
+            raise ValueError("Proposed team members must be unique.")
+
+        mask = self._mask(team)
+        self._record(ACTION_PROPOSE, player_name, mask)
+        # Kept in seat order, like the log, so a replayed game matches exactly
+        self.proposed_team = self._names(mask)
         self.mechanic_mode = "voting"
-        self.log.append(f"{player_name} proposed {team}")
-    
+        self.log.append(LogEvent(LOG_PROPOSED, self.player_index[player_name], mask, 0))
+        self.version += 1
+
     def player_vote(self, player_name, vote):
         if self.mechanic_mode != "voting":
             raise ValueError("It is not time for voting on the proposed mission.")
 
-        if player_name not in self.player_characters:
+        if player_name not in self.player_index:
             raise ValueError("Player is not part of the game.")
 
-        # Add or update the player's vote
+        # Add or update the player's vote. A changed vote overwrites the recorded one,
+        # so actions stay bounded by the length of the game however often players change their minds
+        if player_name in self.votes:
+            self._rerecord_vote(player_name, vote)
+        else:
+            self._record(ACTION_VOTE, player_name, 1 if vote else 0)
         self.votes[player_name] = vote
+        self.version += 1
 
         # Check if all players have voted
-        if len(self.votes) == len(self.player_characters):
+        if len(self.votes) == len(self.players):
             true_votes = sum(self.votes.values())
 
             # Check if the vote fails
-            if true_votes <= len(self.player_characters) / 2:
-                self.log.append(f"rejected by {[k for (k, v) in self.votes.items() if not v]}")
+            if true_votes <= len(self.players) / 2:
+                self.log.append(LogEvent(LOG_REJECTED, -1, self._mask(k for (k, v) in self.votes.items() if v), 0))
                 self.consecutive_rejects += 1
                 self.proposed_team = []
                 self.votes = {}
                 if self.consecutive_rejects == 5:
                     self.winner = "evil"
                     self.mechanic_mode = "ended"
-                    self.log.append("Evil team wins via rejections.")
+                    self.log.append(LogEvent(LOG_EVIL_REJECTIONS, -1, 0, 0))
                 else:
-                    self.current_turn = (self.current_turn + 1) % len(self.player_characters)
+                    self.current_turn = (self.current_turn + 1) % len(self.players)
                     self.mechanic_mode = "proposal"
             else:
-                self.log.append(f"approved by {[k for (k, v) in self.votes.items() if v]}")
+                self.log.append(LogEvent(LOG_APPROVED, -1, self._mask(k for (k, v) in self.votes.items() if v), 0))
                 self.mechanic_mode = "mission"
 
     def player_mission_act(self, player_name, succeed_mission):
@@ -159,11 +423,13 @@ class AvalonGame:
         if player_name not in self.proposed_team:
             raise ValueError("Player is not in the mission team.")
 
-        if self.player_characters[player_name] in ["Merlin", "Percival", "Knight"] and not succeed_mission:
+        if self.roles[self.player_index[player_name]] & GOOD_ROLES and not succeed_mission:
             raise ValueError("Good team can't sabotage missions.")
 
         # Add mission action
+        self._record(ACTION_MISSION, player_name, 1 if succeed_mission else 0)
         self.mission_actions[player_name] = succeed_mission
+        self.version += 1
 
         # Check if all required players have acted
         if len(self.mission_actions) == self.mission_participants[len(self.completed_missions)]:
@@ -171,7 +437,7 @@ class AvalonGame:
             mission_fail_count = sum(not action for action in self.mission_actions.values())
             mission_result = mission_fail_count < self.fails_required[len(self.completed_missions)]
             self.completed_missions.append(mission_result)
-            self.log.append(f"mission {'passed' if mission_result else 'failed'} with {mission_fail_count} fails")
+            self.log.append(LogEvent(LOG_MISSION_PASSED if mission_result else LOG_MISSION_FAILED, -1, 0, mission_fail_count))
 
             # Reset states for the next mission
             self.proposed_team = []
@@ -181,32 +447,36 @@ class AvalonGame:
             if sum([not m for m in self.completed_missions]) >= 3:
                 self.winner = "evil"
                 self.mechanic_mode = "ended"
-                self.log.append("Evil team wins via missions")
+                self.log.append(LogEvent(LOG_EVIL_MISSIONS, -1, 0, 0))
             elif sum(self.completed_missions) >= 3:
-                if "Assassin" in self.player_characters.values():
-                    self.mechanic_mode = "assassination" 
+                if self.role_mask & Role.ASSASSIN:
+                    self.mechanic_mode = "assassination"
                 else:
                     self.winner = "good"
                     self.mechanic_mode = "ended"
-                    self.log.append("Good team wins")
+                    self.log.append(LogEvent(LOG_GOOD_WINS, -1, 0, 0))
             else:
-                self.current_turn = (self.current_turn + 1) % len(self.player_characters)
+                self.current_turn = (self.current_turn + 1) % len(self.players)
                 self.mechanic_mode = "proposal"
-        
+
     def assassination(self, player_name, target):
         if self.mechanic_mode != "assassination":
             raise ValueError("It is not time for assassination.")
 
-        if self.player_characters[player_name] != "Assassin":
+        index = self.player_index.get(player_name)
+        if index is None or self.roles[index] != Role.ASSASSIN:
             raise ValueError("This player is not the Assassin.")
-        
-        if target not in self.player_characters:
+
+        target_index = self.player_index.get(target)
+        if target_index is None:
             raise ValueError("Target is not part of the game.")
-        
-        if self.player_characters[target] == "Merlin":
+
+        self._record(ACTION_ASSASSINATE, player_name, target_index)
+        if self.roles[target_index] == Role.MERLIN:
             self.winner = "evil"
-            self.log.append("Evil team wins via assassination")
+            self.log.append(LogEvent(LOG_EVIL_ASSASSINATION, -1, 0, 0))
         else:
             self.winner = "good"
-            self.log.append("Good team wins")
+            self.log.append(LogEvent(LOG_GOOD_WINS, -1, 0, 0))
         self.mechanic_mode = "ended"
+        self.version += 1
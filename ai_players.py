@@ -0,0 +1,243 @@
+from AvalonGame import GOOD_ROLES, ROLE_SIGHT, Role
+from itertools import combinations
+from updates import wait_for_any_change
+import math
+import random
+import sys
+import threading
+import time
+import traceback
+
+BOT_NAMES = ["BotAda", "BotBea", "BotCy", "BotDot", "BotEli", "BotFay", "BotGus", "BotHal", "BotIvy", "BotJo"]
+THINK_TIME = 0.5
+EXPLORATION = 0.7
+
+# Event kind for the action each phase is waiting on
+PHASE_KINDS = {
+    "proposal": "propose",
+    "voting": "vote",
+    "mission": "mission",
+    "assassination": "assassinate"
+}
+
+def sample_roles(game, player_name, rng):
+    # Uniform over role assignments consistent with what player_name was told
+    me = game.player_index[player_name]
+    my_role = game.roles[me]
+    others = [i for i in range(len(game.players)) if i != me]
+    remaining = list(game.roles)
+    remaining.remove(my_role)
+
+    roles = [None] * len(game.players)
+    roles[me] = my_role
+    known = game.visibility[me]
+    if known is None:
+        rng.shuffle(remaining)
+        for i, role in zip(others, remaining):
+            roles[i] = role
+        return roles
+
+    sight = ROLE_SIGHT[my_role]
+    seen_roles = [role for role in remaining if role & sight]
+    unseen_roles = [role for role in remaining if not role & sight]
+    seen_players = [i for i in others if known >> i & 1]
+    unseen_players = [i for i in others if not known >> i & 1]
+    rng.shuffle(seen_roles)
+    rng.shuffle(unseen_roles)
+    for i, role in zip(seen_players, seen_roles):
+        roles[i] = role
+    for i, role in zip(unseen_players, unseen_roles):
+        roles[i] = role
+    return roles
+
+def determinize(game, player_name, rng):
+    # A full game consistent with player_name's information set. Votes and
+    # mission actions other players have cast but not revealed are dropped.
+    state = game.clone(sample_roles(game, player_name, rng))
+    state.votes = {p: v for p, v in state.votes.items() if p == player_name}
+    state.mission_actions = {p: v for p, v in state.mission_actions.items() if p == player_name}
+    return state
+
+def pending_players(game):
+    if game.mechanic_mode == "proposal":
+        return [game.players[game.turn_indices[game.current_turn]]]
+    if game.mechanic_mode == "voting":
+        return [p for p in game.players if p not in game.votes]
+    if game.mechanic_mode == "mission":
+        return [p for p in game.proposed_team if p not in game.mission_actions]
+    if game.mechanic_mode == "assassination":
+        return [game.players[game.roles.index(Role.ASSASSIN)]]
+    return []
+
+def legal_actions(game, player_name):
+    mode = game.mechanic_mode
+    if mode == "proposal":
+        size = game.mission_participants[len(game.completed_missions)]
+        return list(combinations(game.players, size))
+    if mode == "voting":
+        return [True, False]
+    if mode == "mission":
+        if game.roles[game.player_index[player_name]] & GOOD_ROLES:
+            return [True]
+        return [True, False]
+    if mode == "assassination":
+        return [p for p in game.players if p != player_name]
+    return []
+
+def random_action(game, player_name, rng):
+    mode = game.mechanic_mode
+    if mode == "proposal":
+        return tuple(rng.sample(game.players, game.mission_participants[len(game.completed_missions)]))
+    if mode == "voting":
+        return rng.random() < 0.5
+    if mode == "mission":
+        return bool(game.roles[game.player_index[player_name]] & GOOD_ROLES) or rng.random() < 0.5
+    return rng.choice([p for p in game.players if p != player_name])
+
+def play(game, player_name, action):
+    mode = game.mechanic_mode
+    if mode == "proposal":
+        game.propose_team(player_name, list(action))
+    elif mode == "voting":
+        game.player_vote(player_name, action)
+    elif mode == "mission":
+        game.player_mission_act(player_name, action)
+    elif mode == "assassination":
+        game.assassination(player_name, action)
+
+def team_of(game, player_name):
+    return "good" if game.roles[game.player_index[player_name]] & GOOD_ROLES else "evil"
+
+class Node:
+    __slots__ = ('parent', 'action', 'actor', 'children', 'visits', 'wins', 'avail')
+
+    def __init__(self, parent, action, actor):
+        self.parent = parent
+        self.action = action
+        self.actor = actor
+        self.children = {}
+        self.visits = 0
+        self.wins = 0
+        self.avail = 1
+
+    def ucb(self):
+        return self.wins / self.visits + EXPLORATION * math.sqrt(math.log(self.avail) / self.visits)
+
+def ismcts(game, player_name, think_time=THINK_TIME, rng=None, max_iterations=None):
+    # Single-observer information set MCTS: every iteration searches a fresh
+    # determinization, and children only count visits when they were legal
+    rng = rng or random.Random()
+    root = Node(None, None, None)
+    deadline = time.monotonic() + think_time
+    iterations = 0
+    while time.monotonic() < deadline and (max_iterations is None or iterations < max_iterations):
+        iterations += 1
+        state = determinize(game, player_name, rng)
+        node = root
+        actor = player_name
+
+        # Selection and expansion
+        while state.mechanic_mode != "ended":
+            actions = legal_actions(state, actor)
+            legal_children = [node.children[a] for a in actions if a in node.children]
+            for child in legal_children:
+                child.avail += 1
+            untried = [a for a in actions if a not in node.children]
+            if untried:
+                action = rng.choice(untried)
+                child = Node(node, action, actor)
+                node.children[action] = child
+                play(state, actor, action)
+                node = child
+                break
+            node = max(legal_children, key=Node.ucb)
+            play(state, actor, node.action)
+            actor = pending_players(state)[0] if state.mechanic_mode != "ended" else None
+
+        # Random rollout to the end of the game
+        while state.mechanic_mode != "ended":
+            actor = pending_players(state)[0]
+            play(state, actor, random_action(state, actor, rng))
+
+        # Each node scores the game for the team of whoever chose its action
+        while node.parent is not None:
+            node.visits += 1
+            if team_of(state, node.actor) == state.winner:
+                node.wins += 1
+            node = node.parent
+
+    if not root.children:
+        return random_action(game, player_name, rng)
+    return max(root.children.values(), key=lambda child: child.visits).action
+
+def bot_names(taken, count):
+    return [name for name in BOT_NAMES if name not in taken][:count]
+
+class BotRunner:
+    # Plays bot seats from a background thread so searches never hold up requests
+    def __init__(self, games, act, start_game, think_time=THINK_TIME):
+        self.games = games
+        self.act = act
+        self.start_game = start_game
+        self.think_time = think_time
+        self.bot_games = set()
+        self.rng = random.Random()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def watch(self, game_id):
+        with self.lock:
+            self.bot_games.add(game_id)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            acted = False
+            for game_id in list(self.bot_games):
+                try:
+                    acted = self.step(game_id) or acted
+                except ValueError:
+                    # A human moved first and the action no longer applies; try again next pass
+                    pass
+                except Exception:
+                    # A backend timeout or a bad position must not end the one bot thread
+                    # and freeze every other bot game; this game is retried next pass
+                    print(f"bot move in game {game_id} failed:", file=sys.stderr)
+                    traceback.print_exc()
+            if not acted:
+                wait_for_any_change()
+
+    def step(self, game_id):
+        game_info = self.games.get(game_id)
+        if game_info is None:
+            self.bot_games.discard(game_id)
+            return False
+        this_game = game_info.get("game_object")
+        if this_game is None:
+            if len(game_info['players']) == game_info['number_of_players']:
+                self.start_game(game_id)
+                return True
+            return False
+        if this_game.mechanic_mode == "ended":
+            self.bot_games.discard(game_id)
+            return False
+
+        bots = game_info.get('bots', [])
+        for player_name in pending_players(this_game):
+            if player_name in bots:
+                # Search a private copy, taken under the lock so it is never half-updated;
+                # act() only applies the move if the game hasn't moved on
+                with self.games.locked(game_id) as game_info:
+                    if game_info is None or game_info.get("game_object") is None:
+                        return False
+                    position = game_info["game_object"].clone()
+                if player_name not in pending_players(position):
+                    return False
+                action = ismcts(position, player_name, self.think_time, self.rng)
+                if position.mechanic_mode == "proposal":
+                    action = list(action)
+                # One move per pass; the game is re-read before the next one
+                return self.act(game_id, PHASE_KINDS[position.mechanic_mode], player_name, action, position.version)
+        return False
@@ -0,0 +1,148 @@
+from archive import record_json, replay
+from flask import Blueprint, Response, jsonify, request
+import json
+from updates import state_version
+
+def game_etag(game_id, game_info, *extra):
+    # created tells apart games that reused an evicted game's id
+    parts = [game_id, game_info.get('created'), state_version(game_info)] + list(extra)
+    return '-'.join(str(part) for part in parts)
+
+def conditional_json(etag, build):
+    # Unchanged polls get a bodiless 304 without building the payload at all
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def game_summary(game_id, game_info):
+    this_game = game_info.get("game_object")
+    summary = {
+        "game_id": game_id,
+        "version": state_version(game_info),
+        "number_of_players": game_info['number_of_players'],
+        "players": game_info['players']
+    }
+    if this_game is None:
+        summary["game_state"] = {"current_mechanic_mode": "waiting"}
+        return summary
+    summary["game_params"] = this_game.get_game_params()
+    summary["game_state"] = this_game.get_game_state()
+    summary["log_length"] = len(this_game.log)
+    if this_game.mechanic_mode == "ended":
+        summary["game_results"] = this_game.get_game_results()
+    return summary
+
+def create_api_blueprint(games, archive=None, lobbies=None):
+    api = Blueprint('api', __name__, url_prefix='/avalom/api/v1')
+
+    @api.route('/lobbies')
+    def open_lobbies():
+        # Served from the lobby index, fullest first; ?num_players= narrows it to one size
+        if lobbies is None:
+            return jsonify(lobbies=[])
+        size = request.args.get('num_players', type=int)
+        return jsonify(lobbies=[
+            {"game_id": game_id, "number_of_players": number_of_players, "players": players,
+             "open_seats": number_of_players - len(players)}
+            for game_id, number_of_players, players in lobbies.open_lobbies(size)
+        ])
+
+    @api.route('/games/<int:game_id>')
+    def game(game_id):
+        game_info = games.get(game_id)
+        if not game_info:
+            return jsonify(error="Game not found"), 404
+        return conditional_json(game_etag(game_id, game_info), lambda: game_summary(game_id, game_info))
+
+    @api.route('/games/<int:game_id>/players/<player_name>')
+    def player(game_id, player_name):
+        game_info = games.get(game_id)
+        if not game_info:
+            return jsonify(error="Game not found"), 404
+        if player_name not in game_info['players']:
+            return jsonify(error="Player not found in game"), 404
+        this_game = game_info.get("game_object")
+
+        def build():
+            known_info = this_game.get_player_known_info(player_name) if this_game else None
+            return {
+                "game_id": game_id,
+                "version": state_version(game_info),
+                "player_name": player_name,
+                "known_info": known_info
+            }
+
+        return conditional_json(game_etag(game_id, game_info, player_name), build)
+
+    @api.route('/games/<int:game_id>/log')
+    def log(game_id):
+        # ?since=n&limit=m for a window from entry n, or ?tail=m for the last m entries
+        game_info = games.get(game_id)
+        if not game_info:
+            return jsonify(error="Game not found"), 404
+        this_game = game_info.get("game_object")
+        total = len(this_game.log) if this_game else 0
+        tail = request.args.get('tail', type=int)
+        if tail is not None:
+            since = max(total - max(tail, 0), 0)
+        else:
+            since = min(max(request.args.get('since', 0, type=int), 0), total)
+        limit = request.args.get('limit', type=int)
+        stop = total if limit is None else min(total, since + max(limit, 0))
+
+        def build():
+            return {
+                "game_id": game_id,
+                "since": since,
+                "next": stop,
+                "total": total,
+                "log": this_game.log_lines(since, stop) if this_game else []
+            }
+
+        # Votes bump the version without adding log lines, so key on the window instead
+        etag = '-'.join(str(part) for part in [game_id, game_info.get('created'), 'log', since, stop])
+        return conditional_json(etag, build)
+
+    @api.route('/archive')
+    def archive_export():
+        # Streams archived games as JSON lines; resume from the last line's "next" with ?since=
+        if archive is None:
+            return jsonify(error="No archive configured"), 404
+        since = request.args.get('since', type=int)
+        limit = request.args.get('limit', type=int)
+        try:
+            # Checks since before the first byte is sent
+            records = archive.records(since, limit)
+            first = next(records, None)
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+
+        def stream():
+            if first is not None:
+                yield json.dumps(record_json(*first)) + '\n'
+            for offset, record in records:
+                yield json.dumps(record_json(offset, record)) + '\n'
+
+        return Response(stream(), mimetype='application/x-ndjson')
+
+    @api.route('/archive/<int:offset>')
+    def archived_game(offset):
+        if archive is None:
+            return jsonify(error="No archive configured"), 404
+        try:
+            record = archive.load(offset)
+        except ValueError as error:
+            return jsonify(error=str(error)), 404
+        this_game = replay(record)
+        return jsonify(
+            offset=offset,
+            game_id=record["game_id"],
+            game_params=this_game.get_game_params(),
+            game_results=this_game.get_game_results()
+        )
+
+    return api
@@ -1,31 +1,223 @@
-from flask import Flask, request, redirect, render_template, url_for
+from flask import Flask, Response, jsonify, request, redirect, render_template, url_for
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from helpers import *
+import os
 import re
 import sys
+import threading
+import time
 from AvalonGame import AvalonGame
+from ai_players import BotRunner, bot_names
+from api import create_api_blueprint
+from archive import Archive, replay
+from game_store import ACTION_FIELDS, GameStore, apply_action, valid_action_value
+from lifecycle import GameLifecycle, touch
+from lobby import make_lobby_index
+from metrics import SlowRequestProfiler, games_by_mode, install_metrics
+from pages import PRIVATE_CACHE_CONTROL, STATIC_CACHE_CONTROL, CompressedPage, source_mtime
+from rate_limits import DEFAULT_URI, LIVE_LIMIT, MUTATION_LIMIT, STATIC_LIMIT
+from state_backends import MemoryBackend, make_backend
+from updates import notify_changed, state_delta, state_version, wait_for_change
+import json
+
+# Log entries shown on in-game pages
+LOG_TAIL = 10
+MAX_BATCH_ACTIONS = 200
+# Addresses allowed to scrape /metrics, which reads every game; AVALONG_METRICS_ALLOW adds more
+METRICS_ALLOW = {'127.0.0.1', '::1'} | {
+    address.strip() for address in os.environ.get('AVALONG_METRICS_ALLOW', '').split(',') if address.strip()}
+# How soon EventSource reconnects once a stream response ends
+SSE_RETRY_MS = 1000
+# Long-polls and streams that may wait at once. Each one holds a worker thread, so
+# keep this below threads in fcgi_conf_alt.ini to leave some for pages; clients
+# over the limit are told to come back after BUSY_RETRY_SECONDS
+MAX_WAITING = 24
+BUSY_RETRY_SECONDS = 10
+# Lobbies a matchmaking request tries before opening a new one, if it keeps losing races
+MATCHMAKE_ATTEMPTS = 5
 
 app = Flask(__name__)
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["2000 per day", "400 per hour", "8 per second"],
-    # I should change the below if I care about performance or multiple nodes
-    storage_uri="memory://" 
+    # Counters live in a shared-memory file so every worker on the host enforces
+    # the same limits; AVALONG_LIMITS can point elsewhere, e.g. redis://
+    storage_uri=os.environ.get('AVALONG_LIMITS', DEFAULT_URI),
+    # benchmark.py sets this so load tests aren't throttled
+    enabled=os.environ.get('AVALONG_DISABLE_LIMITS') != '1',
+    # Returning None keeps the default 429 response
+    on_breach=lambda limit: metrics.reject(request.endpoint or 'unmatched')
 )
 
-games = {}
+# Set AVALONG_PROFILE_SLOW_MS to print the hottest stacks of requests slower than that
+profile_slow_ms = os.environ.get('AVALONG_PROFILE_SLOW_MS')
+install_metrics(app, metrics, SlowRequestProfiler(float(profile_slow_ms) / 1000) if profile_slow_ms else None)
+
+# Every route that changes a game draws from one bucket per client
+mutation_limit = limiter.shared_limit(MUTATION_LIMIT, scope="mutation")
+
+waiting = threading.BoundedSemaphore(MAX_WAITING)
+
+# Every action is logged to disk so games survive restarts
+store = GameStore()
+
+# memory:// keeps games in this process; use sqlite:// or redis:// to run several workers
+games = make_backend(os.environ.get('AVALONG_STATE', 'memory://'))
+if isinstance(games, MemoryBackend):
+    games.load(store.restore())
+
+# Ended games are packed into a compact binary archive and can be replayed from it
+archive = Archive()
+
+# Open lobbies by size, for matchmaking and the lobby list
+lobbies = make_lobby_index(games)
+lobbies.load(games.items())
+
+# Archives ended games, drops stale lobbies and spills idle games to disk
+lifecycle = GameLifecycle(games, store, archive, lobbies)
+lifecycle.start()
+
+# Read-only JSON view of games for bots and the mobile wrapper
+app.register_blueprint(create_api_blueprint(games, archive, lobbies))
+
+def record_change(game_id, game_info, kind, **payload):
+    # Call with the game locked; call notify_changed() once the lock is released
+    touch(game_info)
+    with metrics.phase('store'):
+        store.record(game_id, kind, game_info, **payload)
+
+def start_game(game_id):
+    with games.locked(game_id) as game_info:
+        # Another request may have started the game while we waited
+        if game_info is not None and not game_info.get("game_object"):
+            deal_game(game_id, game_info)
+    return game_info
+
+def deal_game(game_id, game_info):
+    # Call with the game locked
+    with metrics.phase('game'):
+        game_info["game_object"] = AvalonGame(game_info['players'])
+    record_change(
+        game_id, game_info, 'start',
+        players=game_info['players'],
+        characters=game_info["game_object"].characters,
+        seed=game_info["game_object"].seed
+    )
+
+def seat_players(game_id, game_info, usernames, bot=False):
+    # Call with the lobby locked. Seats whoever fits, starts the game the
+    # moment the lobby fills, and returns the names that were seated.
+    seated = []
+    for username in usernames:
+        if username in game_info['players'] or len(game_info['players']) >= game_info['number_of_players']:
+            continue
+        game_info['players'].append(username)
+        if bot:
+            game_info.setdefault('bots', []).append(username)
+            record_change(game_id, game_info, 'join', username=username, bot=True)
+        else:
+            record_change(game_id, game_info, 'join', username=username)
+        seated.append(username)
+    if len(game_info['players']) == game_info['number_of_players'] and not game_info.get("game_object"):
+        deal_game(game_id, game_info)
+    lobbies.update(game_id, game_info)
+    return seated
+
+def open_lobby(username, num_players):
+    created = time.time()
+    game_info = {
+        'number_of_players': num_players,
+        'players': [username],
+        'created': created,
+        'last_active': created
+    }
+    game_id = games.create(game_info)
+    store.record(game_id, 'create', number_of_players=num_players, username=username, created=created)
+    lobbies.update(game_id, game_info)
+    return game_id
+
+def perform_action(game_id, kind, player_name, value, expected_version=None):
+    # Applies one game action; with expected_version, skips it if the game has moved on
+    with games.locked(game_id) as game_info:
+        if game_info is None:
+            raise ValueError("Game not found.")
+        if not game_info.get("game_object"):
+            raise ValueError("Game has not started.")
+        this_game = game_info["game_object"]
+        if expected_version is not None and this_game.version != expected_version:
+            return False
+        with metrics.phase('game'):
+            apply_action(this_game, kind, player_name, value)
+        record_change(game_id, game_info, kind, player_name=player_name, **{ACTION_FIELDS[kind][1]: value})
+    notify_changed()
+    return True
+
+def perform_batch(game_id, actions):
+    # Applies a game's actions all or none: they run on a copy, which replaces
+    # the game only once every one of them has succeeded
+    with games.locked(game_id) as game_info:
+        if game_info is None:
+            return [{"ok": False, "error": "Game not found."} for _ in actions]
+        if not game_info.get("game_object"):
+            return [{"ok": False, "error": "Game has not started."} for _ in actions]
+        this_game = game_info["game_object"].clone()
+        results = []
+        for position, action in enumerate(actions):
+            try:
+                if action.get('version') is not None and action['version'] != this_game.version:
+                    raise ValueError("Game has moved on.")
+                with metrics.phase('game'):
+                    apply_action(this_game, action['kind'], action['player_name'], action['value'])
+            except ValueError as error:
+                failed = {"ok": False, "error": "Not applied: another action for this game failed."}
+                return [failed] * position + [{"ok": False, "error": str(error)}] + [failed] * (len(actions) - position - 1)
+            results.append({"ok": True, "version": this_game.version})
+        game_info["game_object"] = this_game
+        for action in actions:
+            record_change(game_id, game_info, action['kind'], player_name=action['player_name'],
+                          **{ACTION_FIELDS[action['kind']][1]: action['value']})
+    return results
+
+def parse_batch_action(action):
+    # Returns the action with its value checked against the kind, or None if malformed
+    if not isinstance(action, dict) or not isinstance(action.get('game_id'), int):
+        return None
+    kind = action.get('kind')
+    value = action.get('value')
+    version = action.get('version')
+    if not isinstance(action.get('player_name'), str) or (version is not None and not isinstance(version, int)):
+        return None
+    return action if valid_action_value(kind, value) else None
+
+# Bots think in a background thread and act through the same path as players
+bot_runner = BotRunner(games, perform_action, start_game)
+for game_id, game_info in games.items():
+    if game_info.get('bots') and not (game_info.get('game_object') and game_info['game_object'].mechanic_mode == "ended"):
+        bot_runner.watch(game_id)
 
 @app.route('/')
+@limiter.limit(STATIC_LIMIT)
 def meta_home():
     return redirect(url_for('home'))
 
+# The home page never changes while the server runs, so it is rendered and compressed once
+with app.app_context():
+    home_page = CompressedPage(
+        render_markdown_template('home'),
+        last_modified=source_mtime(os.path.join(MARKDOWN_DIR, 'home.md'),
+                                   os.path.join(app.root_path, app.template_folder, 'general_markdown.html')),
+        best=True
+    )
+
 @app.route('/avalom/')
+@limiter.limit(STATIC_LIMIT)
 def home():
-    return render_markdown_template('home')
+    return home_page.response(STATIC_CACHE_CONTROL)
 
 @app.route('/avalom/create_game')
+@mutation_limit
 def create_game():
     username = request.args.get('username', '').strip()
     num_players = request.args.get('num_players', '').strip()
@@ -41,19 +233,14 @@ def create_game():
     except ValueError:
         return redirect(url_for('home'))
 
-    # Find the lowest positive integer not already used as a key
-    game_id = min(set(range(1, len(games) + 2)) - set(games.keys()))
-
     # Create a new game entry
-    games[game_id] = {
-        'number_of_players': num_players,
-        'players': [username]
-    }
+    game_id = open_lobby(username, num_players)
 
     # Redirect to the game page
     return redirect(url_for('game', game_id=game_id, player_name=username))
 
 @app.route('/avalom/join_game')
+@mutation_limit
 def join_game():
     username = request.args.get('username', '').strip()
     game_id = request.args.get('game_id', '').strip()
@@ -70,11 +257,13 @@ def join_game():
         # Redirect back to home if invalid game ID
         return redirect(url_for('home'))
 
-    game = games[game_id]
+    with games.locked(game_id) as game:
+        if game is None:
+            return redirect(url_for('home'))
 
-    # Check if the user is not already in the game and if there is room
-    if username not in game['players'] and len(game['players']) < game['number_of_players']:
-        game['players'].append(username)
+        # Seats the user if they aren't already in the game and there is room
+        seat_players(game_id, game, [username])
+    notify_changed()
 
     # Redirect to the game page only if the user is in the players list
     if username not in game['players']:
@@ -82,25 +271,119 @@ def join_game():
     else:
         return redirect(url_for('game', game_id=game_id, player_name=username))
 
+@app.route('/avalom/matchmake')
+@mutation_limit
+def matchmake():
+    # Seats the player in the fullest open lobby of the requested size, or opens one
+    username = request.args.get('username', '').strip()
+    num_players = request.args.get('num_players', '').strip()
+
+    # username may contain only letters, may not be empty
+    if not username or not re.match("^[A-Za-z]+$", username):
+        return redirect(url_for('home'))
+
+    try:
+        num_players = int(num_players)
+        if num_players not in [5, 6, 7, 8, 9, 10]:
+            raise ValueError("Invalid number of players.")
+    except ValueError:
+        return redirect(url_for('home'))
+
+    for _ in range(MATCHMAKE_ATTEMPTS):
+        game_id = lobbies.fullest(num_players, username)
+        if game_id is None:
+            break
+        with games.locked(game_id) as game_info:
+            if game_info is None:
+                # Evicted by another worker
+                lobbies.remove(game_id)
+                continue
+            seated = seat_players(game_id, game_info, [username])
+        if seated:
+            notify_changed()
+            return redirect(url_for('game', game_id=game_id, player_name=username))
+
+    game_id = open_lobby(username, num_players)
+    return redirect(url_for('game', game_id=game_id, player_name=username))
+
+@app.route('/avalom/add_bots')
+@mutation_limit
+def add_bots():
+    game_id = request.args.get('game_id', '').strip()
+    player_name = request.args.get('player_name', '').strip()
+    try:
+        game_id = int(game_id)
+    except ValueError:
+        return redirect(url_for('home'))
+
+    with games.locked(game_id) as game_info:
+        if game_info is None or player_name not in game_info['players']:
+            return redirect(url_for('home'))
+
+        # Fill every empty seat in the lobby with a bot
+        open_seats = game_info['number_of_players'] - len(game_info['players'])
+        seat_players(game_id, game_info, bot_names(game_info['players'], open_seats), bot=True)
+    notify_changed()
+    bot_runner.watch(game_id)
+
+    return redirect(url_for('game', game_id=game_id, player_name=player_name))
+
 @app.route('/avalom/game/<int:game_id>/<player_name>')
 def game(game_id, player_name):
     game_info = games.get(game_id)
-    if not game_info:
-        return "Game not found", 404
-    if player_name not in game_info.get("players"):
-        return "Player not found in game", 404
+    if not game_info or player_name not in game_info.get("players"):
+        # The id may have been reused since this player's game was archived
+        return archived_game_page(game_id, player_name, live=bool(game_info))
 
-    if len(game_info['players']) < game_info["number_of_players"]:
+    if not game_info.get("game_object") and len(game_info['players']) >= game_info["number_of_players"]:
+        game_info = start_game(game_id)
+
+    # created tells apart games that reused an evicted game's id; lobbies have negative versions
+    cache_key = (game_id, game_info.get('created'), player_name, state_version(game_info))
+    page = render_cache.get(cache_key)
+    if page is None:
+        with metrics.phase('page'):
+            page = CompressedPage(render_player_page(game_id, player_name, game_info))
+        render_cache.put(cache_key, page)
+    return page.response(PRIVATE_CACHE_CONTROL)
+
+def render_player_page(game_id, player_name, game_info):
+    this_game = game_info.get("game_object")
+    if this_game is None:
         return render_markdown_template('game_waiting', {
             "game_id": str(game_id),
             "num_players": str(game_info["number_of_players"]),
-            "player_list": ', '.join(game_info['players'])
-        })
-    elif not game_info.get("game_object"):
-        game_info["game_object"] = AvalonGame(game_info['players'])
-    
-    this_game = game_info.get("game_object")
+            "player_list": ', '.join(game_info['players']),
+            "player_name": player_name
+        }, updates_url=updates_url(game_id, player_name, state_version(game_info)))
+    return render_game_page(game_id, player_name, this_game)
+
+def archived_game_page(game_id, player_name, live=False):
+    # Ended games evicted from memory are rebuilt from the archive to show their results
+    offset = archive.find(game_id, player_name)
+    if offset is None:
+        if live or archive.find(game_id) is not None:
+            return "Player not found in game", 404
+        return "Game not found", 404
+    # The offset identifies the record, so a cached page needs no decoding
+    cache_key = ('archived', offset, player_name)
+    page = render_cache.get(cache_key)
+    if page is None:
+        record = archive.load(offset)
+        page = CompressedPage(render_game_page(game_id, player_name, replay(record)), last_modified=record["ended"] or None)
+        render_cache.put(cache_key, page)
+    return page.response(PRIVATE_CACHE_CONTROL)
+
+def updates_url(game_id, player_name, version):
+    return url_for('game_events', game_id=game_id, player_name=player_name, version=version)
 
+def log_tail(this_game):
+    # Pages show the latest entries only; the whole log is at /avalom/api/v1/games/<id>/log
+    start = max(len(this_game.log) - LOG_TAIL, 0)
+    return ('... ~ ' if start else '') + ' ~ '.join(this_game.log_lines(start))
+
+def render_game_page(game_id, player_name, this_game):
+    page_updates_url = updates_url(game_id, player_name, this_game.version)
     if this_game.mechanic_mode == "proposal":
         player_proposing = this_game.get_game_state()["current_turn"]
         if player_name != player_proposing:
@@ -112,8 +395,8 @@ def game(game_id, player_name):
                 "known_info": str(this_game.get_player_known_info(player_name)),
                 "game_params": str(this_game.get_game_params()),
                 "game_state": str(this_game.get_game_state()),
-                "game_log": ' ~ '.join(this_game.log)
-            })
+                "game_log": log_tail(this_game)
+            }, updates_url=page_updates_url)
         else:
             return render_template(
                 'proposal_on_turn.html',
@@ -125,7 +408,8 @@ def game(game_id, player_name):
                 known_info = str(this_game.get_player_known_info(player_name)),
                 game_params = str(this_game.get_game_params()),
                 game_state = str(this_game.get_game_state()),
-                game_log = ' ~ '.join(this_game.log)
+                game_log = log_tail(this_game),
+                updates_url = page_updates_url
             )
     elif this_game.mechanic_mode == "voting":
         proposed_team = this_game.proposed_team
@@ -142,8 +426,8 @@ def game(game_id, player_name):
             "known_info": str(this_game.get_player_known_info(player_name)),
             "game_params": str(this_game.get_game_params()),
             "game_state": str(this_game.get_game_state()),
-            "game_log": ' ~ '.join(this_game.log)
-        })
+            "game_log": log_tail(this_game)
+        }, updates_url=page_updates_url)
     elif this_game.mechanic_mode == "mission":
         mission_team = this_game.get_game_state()["proposed_team"]
         current_action = this_game.mission_actions.get(player_name)
@@ -160,8 +444,8 @@ def game(game_id, player_name):
                 "known_info": str(this_game.get_player_known_info(player_name)),
                 "game_params": str(this_game.get_game_params()),
                 "game_state": str(this_game.get_game_state()),
-                "game_log": ' ~ '.join(this_game.log)
-            })
+                "game_log": log_tail(this_game)
+            }, updates_url=page_updates_url)
         else:
             return render_markdown_template('mission_off_turn', {
                 "game_id": str(game_id),
@@ -170,8 +454,8 @@ def game(game_id, player_name):
                 "known_info": str(this_game.get_player_known_info(player_name)),
                 "game_params": str(this_game.get_game_params()),
                 "game_state": str(this_game.get_game_state()),
-                "game_log": ' ~ '.join(this_game.log)
-            })
+                "game_log": log_tail(this_game)
+            }, updates_url=page_updates_url)
     elif this_game.mechanic_mode == "assassination":
         assassin_player = [player for player, role in this_game.player_characters.items() if role ==  "Assassin"][0]
         if player_name != assassin_player:
@@ -182,8 +466,8 @@ def game(game_id, player_name):
                 "known_info": str(this_game.get_player_known_info(player_name)),
                 "game_params": str(this_game.get_game_params()),
                 "game_state": str(this_game.get_game_state()),
-                "game_log": ' ~ '.join(this_game.log)
-            })
+                "game_log": log_tail(this_game)
+            }, updates_url=page_updates_url)
         else:
             return render_template(
                 'assassination_on_turn.html',
@@ -193,62 +477,191 @@ def game(game_id, player_name):
                 known_info = str(this_game.get_player_known_info(player_name)),
                 game_params = str(this_game.get_game_params()),
                 game_state = str(this_game.get_game_state()),
-                game_log = ' ~ '.join(this_game.log)
+                game_log = log_tail(this_game),
+                updates_url = page_updates_url
             )
     else:
         return render_markdown_template('ended', {
             "game_id": str(game_id),
             "game_results": str(this_game.get_game_results()),
             "game_params": str(this_game.get_game_params()),
-            "game_log": ' ~ '.join(this_game.log)
+            "game_log": ' ~ '.join(this_game.log_lines())
         })
 
 @app.route('/avalom/proposed_team/')
+@mutation_limit
 def proposed_team():
     selected_members = request.args.getlist('selectedItems')
     game_id = request.args.get('game_id')
     player_name = request.args.get('player_name')
-    this_game = games.get(int(game_id)).get("game_object")
-    mission_size = this_game.mission_participants[len(this_game.completed_missions)]
+    with games.locked(int(game_id)) as game_info:
+        this_game = game_info.get("game_object")
+        mission_size = this_game.mission_participants[len(this_game.completed_missions)]
 
-    if len(selected_members) == mission_size:
-        this_game.propose_team(player_name, selected_members)
+        if len(selected_members) == mission_size:
+            with metrics.phase('game'):
+                this_game.propose_team(player_name, selected_members)
+            record_change(int(game_id), game_info, 'propose', player_name=player_name, team=selected_members)
+    notify_changed()
     
     return redirect(url_for("game", game_id=game_id, player_name=player_name))
 
 @app.route('/avalom/voting_result')
+@mutation_limit
 def voting_result():
     game_id = request.args.get('game_id')
     player_name = request.args.get('player_name')
     vote = request.args.get('vote') is not None and request.args.get('vote').lower() == "yes"
-    this_game = games.get(int(game_id)).get("game_object")
-    this_game.player_vote(player_name, vote)
+    with games.locked(int(game_id)) as game_info:
+        this_game = game_info.get("game_object")
+        with metrics.phase('game'):
+            this_game.player_vote(player_name, vote)
+        record_change(int(game_id), game_info, 'vote', player_name=player_name, vote=vote)
+    notify_changed()
     return redirect(url_for("game", game_id=game_id, player_name=player_name))
 
 @app.route('/avalom/mission_action')
+@mutation_limit
 def mission_action():
     game_id = request.args.get('game_id')
     player_name = request.args.get('player_name')
     action = request.args.get('action') is not None and request.args.get('action').lower() == "succeed"
-    this_game = games.get(int(game_id)).get("game_object")
-    try:
-        this_game.player_mission_act(player_name, action)
-    except ValueError:
-        pass
+    with games.locked(int(game_id)) as game_info:
+        this_game = game_info.get("game_object")
+        try:
+            with metrics.phase('game'):
+                this_game.player_mission_act(player_name, action)
+        except ValueError:
+            pass
+        else:
+            record_change(int(game_id), game_info, 'mission', player_name=player_name, succeed=action)
+    notify_changed()
     return redirect(url_for("game", game_id=game_id, player_name=player_name))
 
 @app.route('/avalom/assassination_selection')
+@mutation_limit
 def assassination_selection():
     game_id = request.args.get('game_id')
     player_name = request.args.get('player_name')
     target = request.args.get('selectedOption')
-    this_game = games.get(int(game_id)).get("game_object")
-    try:
-        this_game.assassination(player_name, target)
-    except ValueError:
-        pass
+    with games.locked(int(game_id)) as game_info:
+        this_game = game_info.get("game_object")
+        try:
+            with metrics.phase('game'):
+                this_game.assassination(player_name, target)
+        except ValueError:
+            pass
+        else:
+            record_change(int(game_id), game_info, 'assassinate', player_name=player_name, target=target)
+    notify_changed()
     return redirect(url_for("game", game_id=game_id, player_name=player_name))
 
+@app.route('/avalom/api/v1/actions', methods=['POST'])
+@mutation_limit
+def batch_actions():
+    # {"actions": [{"game_id", "player_name", "kind", "value", "version"?}, ...]}; no redirects or pages
+    body = request.get_json(silent=True)
+    actions = body.get('actions') if isinstance(body, dict) else None
+    if not isinstance(actions, list) or not actions or len(actions) > MAX_BATCH_ACTIONS:
+        return jsonify(error=f"Expected 1 to {MAX_BATCH_ACTIONS} actions."), 400
+
+    results = [None] * len(actions)
+    by_game = {}
+    for position, action in enumerate(actions):
+        if parse_batch_action(action) is None:
+            results[position] = {"ok": False, "error": "Malformed action."}
+            # A malformed action still sinks the rest of its game's batch
+            if isinstance(action, dict) and isinstance(action.get('game_id'), int):
+                by_game.setdefault(action['game_id'], []).append((position, None))
+        else:
+            by_game.setdefault(action['game_id'], []).append((position, action))
+
+    versions = {}
+    for game_id, entries in by_game.items():
+        if any(action is None for _, action in entries):
+            game_results = [{"ok": False, "error": "Not applied: another action for this game is malformed."}] * len(entries)
+        else:
+            game_results = perform_batch(game_id, [action for _, action in entries])
+        for (position, action), result in zip(entries, game_results):
+            if action is not None:
+                results[position] = dict(result, game_id=game_id)
+        game_info = games.get(game_id)
+        if game_info is not None:
+            versions[str(game_id)] = state_version(game_info)
+    notify_changed()
+    return jsonify(results=results, versions=versions)
+
+@app.route('/avalom/game/<int:game_id>/<player_name>/updates')
+@limiter.limit(LIVE_LIMIT)
+def game_updates(game_id, player_name):
+    # Long-poll: answers as soon as the game moves past ?version=, or after a timeout
+    version = request.args.get('version', type=int)
+    log_index = request.args.get('log_index', 0, type=int)
+    game_info = games.get(game_id)
+    if not game_info or player_name not in game_info['players']:
+        return "Game not found", 404
+    if version is not None:
+        if not waiting.acquire(blocking=False):
+            return "Too many clients waiting", 503, {'Retry-After': str(BUSY_RETRY_SECONDS)}
+        try:
+            game_info = wait_for_change(games, game_id, version)
+        finally:
+            waiting.release()
+        if game_info is None:
+            return "Game not found", 404
+    return jsonify(state_delta(game_info, log_index))
+
+@app.route('/avalom/game/<int:game_id>/<player_name>/events')
+@limiter.limit(LIVE_LIMIT)
+def game_events(game_id, player_name):
+    # Server-Sent Events. Each response carries at most one change and ends after
+    # POLL_TIMEOUT either way, so a waiting player never holds a worker thread for
+    # long; EventSource reconnects after the retry delay and sends back the last
+    # event id, which says where to resume.
+    version = request.args.get('version', type=int)
+    log_index = request.args.get('log_index', 0, type=int)
+    last_event = request.headers.get('Last-Event-ID', '')
+    if re.match(r"^-?\d+:\d+$", last_event):
+        version, log_index = (int(part) for part in last_event.split(':'))
+    game_info = games.get(game_id)
+    if not game_info or player_name not in game_info['players']:
+        return "Game not found", 404
+
+    def stream(version, log_index):
+        if not waiting.acquire(blocking=False):
+            # Every waiting slot is taken: have the browser come back later instead
+            yield f"retry: {BUSY_RETRY_SECONDS * 1000}\n\n"
+            return
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            game_info = wait_for_change(games, game_id, version)
+            if game_info is None or state_version(game_info) == version:
+                return
+            delta = state_delta(game_info, log_index)
+            event_id = f"{delta['version']}:{delta.get('log_index', log_index)}"
+            yield f"id: {event_id}\ndata: {json.dumps(delta)}\n\n"
+        finally:
+            waiting.release()
+
+    return Response(stream(version, log_index), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    if request.remote_addr not in METRICS_ALLOW:
+        return "Not found", 404
+    gauges = [
+        ('avalong_games', 'gauge', 'Games held by this worker, by mechanic_mode.',
+         [((('mechanic_mode', mode),), count) for mode, count in sorted(games_by_mode(games).items())]),
+        ('avalong_render_cache_hits_total', 'counter', 'Game pages served from the render cache.', [((), render_cache.hits)]),
+        ('avalong_render_cache_misses_total', 'counter', 'Game pages rendered because they were not cached.', [((), render_cache.misses)]),
+        ('avalong_render_cache_entries', 'gauge', 'Pages currently in the render cache.', [((), len(render_cache))]),
+        ('avalong_game_memory_bytes', 'gauge', 'Memory held by memory:// games in this worker as of the last sweep.',
+         [((), lifecycle.total_memory())]),
+        ('avalong_game_memory_largest_bytes', 'gauge', 'Memory held by the largest memory:// game as of the last sweep.',
+         [((), lifecycle.largest_game_memory())])
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug='-d' in sys.argv or '--debug' in sys.argv)
@@ -0,0 +1,269 @@
+from AvalonGame import (ACTION_ASSASSINATE, ACTION_METHODS, ACTION_MISSION, ACTION_PROPOSE, ACTION_SIZE, ACTION_VOTE,
+                        AvalonGame, LogEvent, NAME_BY_ROLE, ROLE_BY_NAME, Role,
+                        decode_actions)
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+import argparse
+import fcntl
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+ARCHIVE_PATH = os.environ.get('AVALONG_ARCHIVE', 'avalong_archive.bin')
+GROW_BYTES = 1 << 20
+
+# File header: magic, format version, offset one past the last record
+MAGIC = b'AVLA'
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct('<4sIQ')
+# Each record is a length prefix and then a body starting with this header:
+# game_id, created, ended, seed, players, winner, flags, actions, log events
+RECORD_LENGTH = struct.Struct('<I')
+RECORD_HEADER = struct.Struct('<IddQBBBIH')
+LOG_ENTRY = struct.Struct('<BbHB')
+
+FLAG_SEED = 2
+
+WINNERS = ["", "good", "evil"]
+ACTION_NAMES = {ACTION_PROPOSE: "propose", ACTION_VOTE: "vote", ACTION_MISSION: "mission", ACTION_ASSASSINATE: "assassinate"}
+
+# Roles are stored as their bit position, one byte per seat
+def role_code(role):
+    return int(role).bit_length() - 1
+
+def code_role(code):
+    return Role(1 << code)
+
+def encode_game(game_id, game_info):
+    # Compact columnar record of an ended game: who sat where, what they did and how it ended
+    this_game = game_info['game_object']
+    players = this_game.players
+    seed = this_game.seed
+    actions = this_game.actions
+    flags = FLAG_SEED if seed is not None else 0
+    parts = [RECORD_HEADER.pack(
+        game_id, game_info.get('created') or 0.0, game_info.get('last_active') or 0.0, seed or 0,
+        len(players), WINNERS.index(this_game.winner), flags,
+        len(actions) // ACTION_SIZE, len(this_game.log)
+    )]
+    for player in players:
+        name = player.encode()
+        parts.append(bytes((len(name),)) + name)
+    parts.append(bytes(role_code(ROLE_BY_NAME[c]) for c in this_game.characters))
+    parts.append(bytes(role_code(role) for role in this_game.roles))
+    parts.append(bytes(this_game.turn_indices))
+    parts.append(bytes(actions))
+    parts.extend(LOG_ENTRY.pack(*event) for event in this_game.log)
+    return b''.join(parts)
+
+def decode_players(body, start=0):
+    # The seating follows the header, so it can be read without decoding the rest.
+    # Returns the players and where the record carries on after them.
+    count = RECORD_HEADER.unpack_from(body, start)[4]
+    offset = start + RECORD_HEADER.size
+    players = []
+    for _ in range(count):
+        length = body[offset]
+        players.append(bytes(body[offset + 1:offset + 1 + length]).decode())
+        offset += 1 + length
+    return players, offset
+
+def decode_record(body):
+    game_id, created, ended, seed, count, winner, flags, num_actions, num_log = RECORD_HEADER.unpack_from(body)
+    players, offset = decode_players(body)
+    characters = [NAME_BY_ROLE[code_role(code)] for code in body[offset:offset + count]]
+    roles = [code_role(code) for code in body[offset + count:offset + 2 * count]]
+    turn_indices = list(body[offset + 2 * count:offset + 3 * count])
+    offset += 3 * count
+    actions = bytes(body[offset:offset + num_actions * ACTION_SIZE])
+    offset += num_actions * ACTION_SIZE
+    log = [LogEvent(*LOG_ENTRY.unpack_from(body, offset + i * LOG_ENTRY.size)) for i in range(num_log)]
+    return {
+        "game_id": game_id,
+        "created": created,
+        "ended": ended,
+        "seed": seed if flags & FLAG_SEED else None,
+        "players": players,
+        "characters": characters,
+        "roles": roles,
+        "turn_indices": turn_indices,
+        "actions": actions,
+        "winner": WINNERS[winner],
+        "log": log
+    }
+
+def replay(record):
+    # Rebuilds the full AvalonGame by re-applying the recorded actions
+    players = record["players"]
+    if record["seed"] is not None:
+        return AvalonGame.replay(record["seed"], players, record["characters"], record["actions"])
+    this_game = AvalonGame(players, record["characters"])
+    this_game.player_characters = {player: NAME_BY_ROLE[role] for player, role in zip(players, record["roles"])}
+    this_game.turn_order = [players[i] for i in record["turn_indices"]]
+    for kind, player_name, argument in decode_actions(players, record["actions"]):
+        getattr(this_game, ACTION_METHODS[kind])(player_name, argument)
+    return this_game
+
+def record_json(offset, record):
+    players = record["players"]
+    return {
+        "offset": offset,
+        "next": record.get("next"),
+        "game_id": record["game_id"],
+        "created": record["created"],
+        "ended": record["ended"],
+        "seed": record["seed"],
+        "players": players,
+        "characters": record["characters"],
+        "player_characters": {player: NAME_BY_ROLE[role] for player, role in zip(players, record["roles"])},
+        "turn_order": [players[i] for i in record["turn_indices"]],
+        "actions": [[ACTION_NAMES[kind], player, argument]
+                    for kind, player, argument in decode_actions(players, record["actions"])],
+        "winner": record["winner"],
+        "log": [list(event) for event in record["log"]]
+    }
+
+class Archive:
+    # Append-only file of encoded records, written and read through mmap.
+    # Appends from several workers are serialised with an fcntl lock, and the
+    # header's end offset is the only thing readers trust.
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        # game_id -> offsets of its records, oldest first, as ids are reused once
+        # games are evicted; and every record's offset in file order. Both are
+        # filled in by scanning.
+        self.index = {}
+        self.offsets = array('Q')
+        self.indexed_to = FILE_HEADER.size
+        with self._file_lock():
+            if os.fstat(self.fd).st_size < FILE_HEADER.size:
+                os.ftruncate(self.fd, GROW_BYTES)
+                os.pwrite(self.fd, FILE_HEADER.pack(MAGIC, FORMAT_VERSION, FILE_HEADER.size), 0)
+            self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+        magic, version, _ = FILE_HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} game archive.")
+
+    @contextmanager
+    def _file_lock(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def _end(self):
+        return FILE_HEADER.unpack_from(self.map)[2]
+
+    def _view(self, end):
+        # Another worker may have grown the file since we mapped it.
+        # Old maps are left for the garbage collector, as readers may still hold them.
+        if end > len(self.map):
+            self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+        return self.map
+
+    def append(self, game_id, game_info):
+        body = encode_game(game_id, game_info)
+        record = RECORD_LENGTH.pack(len(body)) + body
+        with self.lock, self._file_lock():
+            end = self._end()
+            size = os.fstat(self.fd).st_size
+            if end + len(record) > size:
+                size = max(size * 2, end + len(record) + GROW_BYTES)
+                os.ftruncate(self.fd, size)
+            view = self._view(size)
+            view[end:end + len(record)] = record
+            # The header moves last, so readers never see a half-written record
+            struct.pack_into('<Q', view, 8, end + len(record))
+        return end
+
+    def records(self, since=None, limit=None):
+        # Yields (offset, record) from since onwards without reading the rest of the file.
+        # record["next"] is where the following record starts, for resuming later.
+        # Raises ValueError up front if since isn't where a record starts.
+        end = self._catch_up()
+        if since is None or since == end:
+            offset = FILE_HEADER.size if since is None else end
+        elif self.is_record(since):
+            offset = since
+        else:
+            raise ValueError("No archived game starts at that offset.")
+        view = self._view(end)
+        count = 0
+        while offset < end and (limit is None or count < limit):
+            length = RECORD_LENGTH.unpack_from(view, offset)[0]
+            body = memoryview(view)[offset + RECORD_LENGTH.size:offset + RECORD_LENGTH.size + length]
+            try:
+                record = decode_record(body)
+            finally:
+                body.release()
+            record["next"] = offset + RECORD_LENGTH.size + length
+            yield offset, record
+            offset = record["next"]
+            count += 1
+
+    def load(self, offset):
+        end = self._catch_up()
+        view = self._view(end)
+        if not self.is_record(offset):
+            raise ValueError("No archived game at that offset.")
+        try:
+            length = RECORD_LENGTH.unpack_from(view, offset)[0]
+            return decode_record(bytes(view[offset + RECORD_LENGTH.size:offset + RECORD_LENGTH.size + length]))
+        except (struct.error, IndexError, KeyError, ValueError, UnicodeDecodeError):
+            # Offsets come from clients, and one inside a record decodes as garbage
+            raise ValueError("No archived game at that offset.")
+
+    def _catch_up(self):
+        # Indexes records appended since the last call, by any worker, and returns the end
+        with self.lock:
+            end = self._end()
+            if self.indexed_to < end:
+                view = self._view(end)
+                offset = self.indexed_to
+                while offset < end:
+                    length = RECORD_LENGTH.unpack_from(view, offset)[0]
+                    game_id = RECORD_HEADER.unpack_from(view, offset + RECORD_LENGTH.size)[0]
+                    self.index.setdefault(game_id, []).append(offset)
+                    self.offsets.append(offset)
+                    offset += RECORD_LENGTH.size + length
+                self.indexed_to = end
+            return end
+
+    def is_record(self, offset):
+        # Offsets come from clients, and one inside a record would decode as garbage
+        i = bisect_left(self.offsets, offset)
+        return i < len(self.offsets) and self.offsets[i] == offset
+
+    def find(self, game_id, player_name=None):
+        # Latest record for game_id, or with player_name the latest one they sat in; None if there is none
+        end = self._catch_up()
+        view = self._view(end)
+        for offset in reversed(self.index.get(game_id, ())):
+            if player_name is None or player_name in decode_players(view, offset + RECORD_LENGTH.size)[0]:
+                return offset
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export or replay games from the binary archive.")
+    parser.add_argument('command', choices=['export', 'replay'])
+    parser.add_argument('--path', default=ARCHIVE_PATH)
+    parser.add_argument('--since', type=int, help="Offset to start exporting from")
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--offset', type=int, help="Record to replay")
+    args = parser.parse_args()
+
+    archive = Archive(args.path)
+    if args.command == 'export':
+        # JSON lines, one game each; pass the last line's "next" back as --since to resume
+        for offset, record in archive.records(args.since, args.limit):
+            sys.stdout.write(json.dumps(record_json(offset, record)) + '\n')
+    else:
+        this_game = replay(archive.load(args.offset))
+        print(json.dumps({"game_params": this_game.get_game_params(), "game_results": this_game.get_game_results()}))
@@ -0,0 +1,399 @@
+from app import app, games, limiter, perform_action
+from concurrent.futures import ThreadPoolExecutor
+from game_store import ACTION_FIELDS, valid_action_value
+from limits import parse_many
+from rate_limits import MUTATION_LIMIT
+from state_backends import MemoryBackend
+from updates import POLL_INTERVAL, POLL_TIMEOUT, add_change_listener, state_delta, state_version
+from urllib.parse import parse_qs, unquote, unquote_to_bytes
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import re
+import struct
+import sys
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_HEADER_BYTES = 65536
+# Request bodies are read into memory before Flask sees them
+MAX_BODY_BYTES = 1 << 20
+MAX_FRAME_BYTES = 65536
+WSGI_THREADS = 16
+# Seconds between SSE comments and WebSocket pings on an idle connection
+KEEPALIVE = 15
+
+# WebSocket actions bypass Flask-Limiter, so each peer gets the action routes' limits here
+WEBSOCKET_LIMITS = parse_many(MUTATION_LIMIT)
+
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# Routes that wait on a game are served on the event loop; everything else goes to Flask
+LIVE_ROUTE = re.compile(r'^/avalom/game/(\d+)/([^/]+)/(updates|events|ws)$')
+
+class Subscriber:
+    __slots__ = ('game_id', 'version', 'log_index', 'queue')
+
+    def __init__(self, game_id, version, log_index):
+        self.game_id = game_id
+        self.version = version
+        self.log_index = log_index
+        self.queue = asyncio.Queue()
+
+class ChangeFeed:
+    # One task re-reads each watched game once per change and fans the delta
+    # out to every connection on it, so idle connections cost no threads
+    def __init__(self, games, executor):
+        self.games = games
+        self.executor = executor
+        self.by_game = {}
+        self.wake = None
+
+    def start(self, loop):
+        self.wake = asyncio.Event()
+        add_change_listener(lambda: loop.call_soon_threadsafe(self.wake.set))
+        loop.create_task(self.run())
+
+    def subscribe(self, game_id, version, log_index):
+        subscriber = Subscriber(game_id, version, log_index)
+        self.by_game.setdefault(game_id, set()).add(subscriber)
+        self.wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self.by_game.get(subscriber.game_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.by_game[subscriber.game_id]
+
+    async def read(self, game_id):
+        # Shared backends do I/O, so keep them off the event loop
+        if isinstance(self.games, MemoryBackend):
+            return self.games.get(game_id)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.games.get, game_id)
+
+    async def run(self):
+        while True:
+            # Other workers can't wake us, so re-read on a timer as well
+            try:
+                await asyncio.wait_for(self.wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            for game_id in list(self.by_game):
+                game_info = await self.read(game_id)
+                for subscriber in list(self.by_game.get(game_id, ())):
+                    if game_info is None:
+                        subscriber.queue.put_nowait(None)
+                    elif state_version(game_info) != subscriber.version:
+                        delta = state_delta(game_info, subscriber.log_index)
+                        subscriber.version = delta["version"]
+                        subscriber.log_index = delta.get("log_index", subscriber.log_index)
+                        subscriber.queue.put_nowait(delta)
+
+def parse_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            name = name.strip().lower()
+            headers[name] = headers[name] + ', ' + value.strip() if name in headers else value.strip()
+    return method, target, version, headers
+
+def encode_frame(opcode, payload):
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x80 | opcode, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, len(payload))
+    return header + payload
+
+async def read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > MAX_FRAME_BYTES:
+        raise ValueError("WebSocket frame too large.")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+def status_response(status, body, content_type='text/plain; charset=utf-8', keep_alive=False):
+    return (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body
+
+class AsyncServer:
+    # asyncio front end: plain pages run through the Flask app on a small
+    # thread pool, while long-polls, SSE and WebSockets wait on the event loop
+    def __init__(self, app, games, act, threads=WSGI_THREADS, limiter=None):
+        self.app = app
+        self.games = games
+        self.act = act
+        self.limiter = limiter
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.feed = ChangeFeed(games, self.executor)
+        self.host = None
+        self.port = None
+
+    async def serve(self, host, port):
+        self.host, self.port = host, port
+        self.feed.start(asyncio.get_running_loop())
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                    method, target, version, headers = parse_head(head)
+                    length = int(headers.get('content-length') or 0)
+                    if not 0 <= length <= MAX_BODY_BYTES:
+                        writer.write(status_response("413 REQUEST ENTITY TOO LARGE", b"Request body too large"))
+                        await writer.drain()
+                        return
+                    body = await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                    return
+                path, _, query = target.partition('?')
+                match = LIVE_ROUTE.match(path)
+                if match:
+                    keep_alive = await self.serve_live(reader, writer, headers, query, *match.groups())
+                else:
+                    keep_alive = await self.serve_wsgi(writer, method, path, query, version, headers, body)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve_wsgi(self, writer, method, path, query, version, headers, body):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        started = []
+
+        def start_response(status, response_headers, exc_info=None):
+            started[:] = [status, response_headers]
+
+        def first_chunk():
+            # Some apps only call start_response once iteration begins
+            result = self.app(environ, start_response)
+            chunks = iter(result)
+            return result, chunks, next(chunks, None)
+
+        loop = asyncio.get_running_loop()
+        result, chunks, chunk = await loop.run_in_executor(self.executor, first_chunk)
+        try:
+            status, response_headers = started
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            length = next((value for name, value in response_headers if name.lower() == 'content-length'), None)
+            # Responses without a length, like the archive export, are streamed as they are
+            # produced rather than held in memory: chunked, or until the connection closes
+            chunked = length is None and version == 'HTTP/1.1' and method != 'HEAD'
+            if length is None and not chunked:
+                keep_alive = False
+            lines = [f"HTTP/1.1 {status}"]
+            lines += [f"{name}: {value}" for name, value in response_headers
+                      if name.lower() not in ('connection', 'transfer-encoding')]
+            if chunked:
+                lines.append("Transfer-Encoding: chunked")
+            lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            while chunk is not None:
+                if chunk and method != 'HEAD':
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+        return keep_alive
+
+    async def serve_live(self, reader, writer, headers, query, game_id, player_name, kind):
+        game_id = int(game_id)
+        player_name = unquote(player_name)
+        args = parse_qs(query)
+        version = int(args['version'][0]) if args.get('version', [''])[0].lstrip('-').isdigit() else None
+        log_index = int(args['log_index'][0]) if args.get('log_index', [''])[0].isdigit() else 0
+
+        game_info = await self.feed.read(game_id)
+        if not game_info or player_name not in game_info['players']:
+            writer.write(status_response("404 NOT FOUND", b"Game not found"))
+            return False
+
+        if kind == 'updates' and version is None:
+            writer.write(status_response("200 OK", json.dumps(state_delta(game_info, log_index)).encode(), 'application/json', True))
+            return True
+
+        subscriber = self.feed.subscribe(game_id, version, log_index)
+        try:
+            if kind == 'updates':
+                return await self.serve_long_poll(writer, subscriber, game_id, log_index)
+            if kind == 'events':
+                await self.serve_events(writer, subscriber)
+            else:
+                await self.serve_websocket(reader, writer, headers, subscriber, game_id, player_name)
+            return False
+        finally:
+            self.feed.unsubscribe(subscriber)
+
+    async def serve_long_poll(self, writer, subscriber, game_id, log_index):
+        try:
+            delta = await asyncio.wait_for(subscriber.queue.get(), POLL_TIMEOUT)
+        except asyncio.TimeoutError:
+            game_info = await self.feed.read(game_id)
+            delta = state_delta(game_info, log_index) if game_info else None
+        if delta is None:
+            writer.write(status_response("404 NOT FOUND", b"Game not found"))
+            return False
+        writer.write(status_response("200 OK", json.dumps(delta).encode(), 'application/json', True))
+        return True
+
+    async def serve_events(self, writer, subscriber):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        while True:
+            try:
+                delta = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE)
+            except asyncio.TimeoutError:
+                writer.write(b": keepalive\n\n")
+            else:
+                if delta is None:
+                    return
+                writer.write(f"data: {json.dumps(delta)}\n\n".encode())
+                if delta["mechanic_mode"] == "ended":
+                    await writer.drain()
+                    return
+            await writer.drain()
+
+    async def serve_websocket(self, reader, writer, headers, subscriber, game_id, player_name):
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or not key:
+            writer.write(status_response("400 BAD REQUEST", b"Expected a WebSocket upgrade"))
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        peer = (writer.get_extra_info('peername') or ('',))[0]
+        receiver = asyncio.ensure_future(self.receive_actions(reader, writer, game_id, player_name, peer))
+        try:
+            while not receiver.done():
+                getter = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, timeout=KEEPALIVE, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    if not receiver.done():
+                        writer.write(encode_frame(OP_PING, b''))
+                        await writer.drain()
+                    continue
+                delta = getter.result()
+                if delta is None:
+                    break
+                writer.write(encode_frame(OP_TEXT, json.dumps(delta).encode()))
+                await writer.drain()
+                if delta["mechanic_mode"] == "ended":
+                    break
+            writer.write(encode_frame(OP_CLOSE, struct.pack('!H', 1000)))
+            await writer.drain()
+        finally:
+            receiver.cancel()
+
+    def allow(self, peer):
+        if self.limiter is None or not self.limiter.enabled:
+            return True
+        return all(self.limiter.limiter.hit(limit, 'websocket', peer) for limit in WEBSOCKET_LIMITS)
+
+    def act_limited(self, peer, game_id, kind, player_name, value, version):
+        if not self.allow(peer):
+            raise ValueError("Rate limit exceeded.")
+        return self.act(game_id, kind, player_name, value, version)
+
+    async def receive_actions(self, reader, writer, game_id, player_name, peer):
+        # Text frames are actions for this seat: {"kind": "vote", "value": true, "version": 7}
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                opcode, payload = await read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                return
+            if opcode == OP_CLOSE:
+                return
+            if opcode == OP_PING:
+                writer.write(encode_frame(OP_PONG, payload))
+                continue
+            if opcode != OP_TEXT:
+                continue
+            try:
+                message = json.loads(payload)
+                if not isinstance(message, dict):
+                    raise ValueError("Actions must be JSON objects.")
+                kind = message.get('kind')
+                value = message.get('value')
+                version = message.get('version')
+                if not valid_action_value(kind, value):
+                    raise ValueError(f"Malformed {kind} action." if kind in ACTION_FIELDS else "Unknown action.")
+                if version is not None and not isinstance(version, int):
+                    raise ValueError("version must be an integer.")
+                applied = await loop.run_in_executor(
+                    self.executor, self.act_limited, peer, game_id, kind, player_name, value, version)
+                reply = {"ok": applied}
+            except (ValueError, TypeError, AttributeError) as error:
+                reply = {"ok": False, "error": str(error)}
+            writer.write(encode_frame(OP_TEXT, json.dumps(reply).encode()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve AvaLong from a single asyncio event loop.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=WSGI_THREADS, help="Threads for requests handled by Flask")
+    args = parser.parse_args()
+    try:
+        asyncio.run(AsyncServer(app, games, perform_action, args.threads, limiter).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,300 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlencode, urlparse
+
+NAMES = ["Alice", "Bob", "Carol", "Dave", "Eve", "Frank", "Gina", "Hank", "Iris", "Jack"]
+
+class TestClientTransport:
+    # In-process requests through Flask's test client, one client per thread
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def get(self, path):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.get(path)
+        return response.status_code, response.get_data(), response.headers.get('Location')
+
+    def post_json(self, path, payload):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.post(path, json=payload)
+        return response.status_code, response.get_data(), response.headers.get('Location')
+
+class HTTPTransport:
+    # Real HTTP against a running server, one keep-alive connection per thread
+    def __init__(self, base_url):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.local = threading.local()
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post_json(self, path, payload):
+        return self.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+
+    def request(self, method, path, body=None, headers={}):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port)
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+        return response.status, response.read(), response.getheader('Location')
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def timed(self, transport, route, path, payload=None):
+        start = time.perf_counter()
+        if payload is None:
+            status, body, location = transport.get(path)
+        else:
+            status, body, location = transport.post_json(path, payload)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, body, location
+
+def game_id_from(location):
+    # create_game redirects to /avalom/game/<id>/<player>
+    if not location or '/avalom/game/' not in location:
+        raise ValueError("create_game did not redirect to a game")
+    return int(location.split('/avalom/game/')[1].split('/')[0])
+
+def percentile(sorted_values, fraction):
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def play_through(transport, recorder, num_players, prefix, batch=False):
+    # Drives one game from creation to the end, reading state from the JSON API.
+    # With batch, each round's votes and mission actions go in one request.
+    players = [prefix + name for name in NAMES[:num_players]]
+    _, _, location = recorder.timed(transport, 'create_game', '/avalom/create_game?' + urlencode(
+        {'username': players[0], 'num_players': num_players}))
+    game_id = game_id_from(location)
+
+    for player in players[1:]:
+        recorder.timed(transport, 'join_game', '/avalom/join_game?' + urlencode({'username': player, 'game_id': game_id}))
+    for player in players:
+        recorder.timed(transport, 'game', f'/avalom/game/{game_id}/{player}')
+
+    characters = {}
+    for player in players:
+        _, body, _ = recorder.timed(transport, 'api_player', f'/avalom/api/v1/games/{game_id}/players/{player}')
+        characters[player] = json.loads(body)['known_info']['character']
+
+    for _ in range(200):
+        _, body, _ = recorder.timed(transport, 'api_game', f'/avalom/api/v1/games/{game_id}')
+        summary = json.loads(body)
+        state = summary['game_state']
+        mode = state['current_mechanic_mode']
+        if mode == 'proposal':
+            size = summary['game_params']['mission_participants'][len(state['completed_missions'])]
+            query = [('game_id', game_id), ('player_name', state['current_turn'])]
+            query += [('selectedItems', player) for player in players[:size]]
+            recorder.timed(transport, 'proposed_team', '/avalom/proposed_team/?' + urlencode(query))
+        elif mode == 'voting' and batch:
+            recorder.timed(transport, 'batch_actions', '/avalom/api/v1/actions', {'actions': [
+                {'game_id': game_id, 'player_name': player, 'kind': 'vote', 'value': True} for player in players]})
+        elif mode == 'mission' and batch:
+            recorder.timed(transport, 'batch_actions', '/avalom/api/v1/actions', {'actions': [
+                {'game_id': game_id, 'player_name': player, 'kind': 'mission', 'value': True} for player in state['proposed_team']]})
+        elif mode == 'voting':
+            for player in players:
+                recorder.timed(transport, 'voting_result', '/avalom/voting_result?' + urlencode(
+                    {'game_id': game_id, 'player_name': player, 'vote': 'yes'}))
+        elif mode == 'mission':
+            for player in state['proposed_team']:
+                recorder.timed(transport, 'mission_action', '/avalom/mission_action?' + urlencode(
+                    {'game_id': game_id, 'player_name': player, 'action': 'succeed'}))
+        elif mode == 'assassination':
+            assassin = next(p for p, c in characters.items() if c == "Assassin")
+            target = next(p for p in players if p != assassin)
+            recorder.timed(transport, 'assassination_selection', '/avalom/assassination_selection?' + urlencode(
+                {'game_id': game_id, 'player_name': assassin, 'selectedOption': target}))
+        else:
+            break
+        # Every player looks at the new page after each step, as they would in a real game
+        for player in players:
+            recorder.timed(transport, 'game', f'/avalom/game/{game_id}/{player}')
+    return game_id
+
+def summarize(recorder, wall_time):
+    routes = {}
+    total = 0
+    for route, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        total += len(values)
+        routes[route] = {
+            'requests': len(values),
+            'errors': recorder.errors.get(route, 0),
+            'throughput': len(values) / wall_time,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000
+        }
+    return {'wall_time': wall_time, 'requests': total, 'throughput': total / wall_time, 'routes': routes}
+
+def run(transport, games, concurrency, num_players, batch=False):
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(play_through, transport, recorder, num_players, f"G{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}", batch)
+                   for i in range(games)]
+        for future in futures:
+            future.result()
+    return summarize(recorder, time.perf_counter() - start)
+
+def memory_per_game(app_module, games, num_players):
+    # Live in-progress games held by the in-process app, measured with tracemalloc
+    transport = TestClientTransport(app_module.app)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(games):
+        players = [f"M{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}{name}" for name in NAMES[:num_players]]
+        _, _, location = transport.get('/avalom/create_game?' + urlencode({'username': players[0], 'num_players': num_players}))
+        game_id = game_id_from(location)
+        for player in players[1:]:
+            transport.get('/avalom/join_game?' + urlencode({'username': player, 'game_id': game_id}))
+        transport.get(f'/avalom/game/{game_id}/{players[0]}')
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return grown / games
+
+def start_server(kind, port, workers, workdir):
+    env = dict(os.environ, AVALONG_DISABLE_LIMITS='1')
+    if workers > 1:
+        # memory:// keeps games inside one worker, so every worker must share the state
+        env['AVALONG_STATE'] = 'sqlite:///' + os.path.join(workdir, 'state.db')
+    here = os.path.dirname(os.path.abspath(__file__))
+    if kind == 'uwsgi':
+        command = ['uwsgi', '--http', f'127.0.0.1:{port}', '--wsgi-file', 'app.py', '--callable', 'app',
+                   '--processes', str(workers), '--enable-threads', '--lazy-apps', '--disable-logging']
+    else:
+        command = [sys.executable, '-c', 'from app import app; from werkzeug.serving import run_simple; '
+                   f'run_simple("127.0.0.1", {port}, app, threaded=True)']
+    server = subprocess.Popen(command, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            http.client.HTTPConnection('127.0.0.1', port, timeout=1).request('GET', '/avalom/')
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise ValueError(f"{kind} server did not start on port {port}")
+
+def server_rss_kb(pid):
+    # The uWSGI master plus its workers
+    output = subprocess.run(['ps', '-o', 'rss=', '-p', str(pid), '--ppid', str(pid)],
+                            capture_output=True, text=True).stdout.split()
+    return sum(int(rss) for rss in output) if output else None
+
+def compare(result, baseline):
+    lines = []
+    for route, stats in result['routes'].items():
+        old = baseline['routes'].get(route)
+        if not old:
+            continue
+        changes = []
+        for key in ['p50_ms', 'p95_ms', 'p99_ms', 'throughput']:
+            if old[key]:
+                changes.append(f"{key} {(stats[key] - old[key]) / old[key] * 100:+.1f}%")
+        lines.append(f"{route:<24} " + ', '.join(changes))
+    if baseline.get('throughput'):
+        lines.append(f"{'overall':<24} throughput {(result['throughput'] - baseline['throughput']) / baseline['throughput'] * 100:+.1f}%")
+    return '\n'.join(lines)
+
+def print_report(result):
+    print(f"{result['requests']} requests in {result['wall_time']:.2f}s, {result['throughput']:.0f} req/s")
+    print(f"{'route':<24} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in result['routes'].items():
+        print(f"{route:<24} {stats['requests']:>8} {stats['errors']:>6} {stats['throughput']:>8.0f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    if result.get('memory_per_game') is not None:
+        print(f"memory per live game: {result['memory_per_game'] / 1024:.1f} KiB")
+    if result.get('server_rss_growth_kb') is not None:
+        print(f"server RSS growth: {result['server_rss_growth_kb']} KiB")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Drive concurrent games through the Flask routes and report latency.")
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--mode', choices=['client', 'uwsgi', 'werkzeug', 'url'], default='client',
+                        help="client: Flask test client in process; uwsgi/werkzeug: start a local server; url: use --url")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch', action='store_true', help="Submit votes and mission actions through the batch endpoint")
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    args = parser.parse_args()
+
+    # Keep benchmark games out of the real event log and away from the rate limits
+    workdir = tempfile.mkdtemp(prefix='avalong-bench-')
+    os.environ['AVALONG_DB'] = os.path.join(workdir, 'bench.db')
+    os.environ['AVALONG_ARCHIVE'] = os.path.join(workdir, 'archive.bin')
+    os.environ['AVALONG_DISABLE_LIMITS'] = '1'
+
+    server = None
+    try:
+        if args.mode == 'client':
+            import app as app_module
+            result = run(TestClientTransport(app_module.app), args.games, args.concurrency, args.players, args.batch)
+            result['memory_per_game'] = memory_per_game(app_module, args.games, args.players)
+        else:
+            if args.mode in ('uwsgi', 'werkzeug'):
+                if args.mode == 'uwsgi' and shutil.which('uwsgi') is None:
+                    raise SystemExit("uwsgi is not installed; try --mode werkzeug")
+                server = start_server(args.mode, args.port, args.workers, workdir)
+                base_url = f'http://127.0.0.1:{args.port}'
+                rss_before = server_rss_kb(server.pid)
+            else:
+                base_url = args.url
+            result = run(HTTPTransport(base_url), args.games, args.concurrency, args.players, args.batch)
+            if server is not None and rss_before is not None:
+                rss_after = server_rss_kb(server.pid)
+                result['server_rss_growth_kb'] = rss_after - rss_before if rss_after else None
+        result['config'] = vars(args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.compare:
+        with open(args.compare) as file:
+            print("\nChange against baseline:")
+            print(compare(result, json.load(file)))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(result, file, indent=2)
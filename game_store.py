@@ -0,0 +1,186 @@
+from AvalonGame import AvalonGame
+import atexit
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+DB_PATH = os.environ.get('AVALONG_DB', 'avalong.db')
+FLUSH_INTERVAL = 0.05
+SNAPSHOT_EVERY = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_game ON events (game_id, seq);
+CREATE TABLE IF NOT EXISTS snapshots (
+    game_id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+"""
+
+# Game actions by event kind: the AvalonGame method and the payload field holding its argument
+ACTION_FIELDS = {
+    'propose': ('propose_team', 'team'),
+    'vote': ('player_vote', 'vote'),
+    'mission': ('player_mission_act', 'succeed'),
+    'assassinate': ('assassination', 'target')
+}
+
+def valid_action_value(kind, value):
+    # Values from JSON clients must have the type AvalonGame expects for the kind;
+    # a string vote would be stored and counted as truthy
+    if kind in ('vote', 'mission'):
+        return isinstance(value, bool)
+    if kind == 'propose':
+        return isinstance(value, list) and all(isinstance(player, str) for player in value)
+    if kind == 'assassinate':
+        return isinstance(value, str)
+    return False
+
+def apply_action(this_game, kind, player_name, value):
+    method, _ = ACTION_FIELDS[kind]
+    getattr(this_game, method)(player_name, value)
+
+def apply_event(games, game_id, kind, payload):
+    if kind == 'create':
+        games[game_id] = {
+            'number_of_players': payload['number_of_players'],
+            'players': [payload['username']],
+            'created': payload['created'],
+            'last_active': payload['created']
+        }
+    elif kind == 'join':
+        games[game_id]['players'].append(payload['username'])
+        if payload.get('bot'):
+            games[game_id].setdefault('bots', []).append(payload['username'])
+    elif kind == 'start':
+        games[game_id]['game_object'] = AvalonGame(payload['players'], payload['characters'], payload['seed'])
+    elif kind in ACTION_FIELDS:
+        value = payload[ACTION_FIELDS[kind][1]]
+        apply_action(games[game_id]['game_object'], kind, payload['player_name'], value)
+    else:
+        raise ValueError(f"Unknown event kind {kind}")
+
+class GameStore:
+    def __init__(self, path=DB_PATH, flush_interval=FLUSH_INTERVAL, snapshot_every=SNAPSHOT_EVERY):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.pending = []
+        self.events_since_snapshot = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.write_lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL with synchronous=NORMAL only fsyncs at checkpoints, not per commit
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SCHEMA)
+
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def record(self, game_id, kind, game_info=None, **payload):
+        # Queued for the writer thread, so requests never wait on disk
+        with self.condition:
+            self.pending.append(('event', game_id, kind, json.dumps(payload), time.time()))
+            count = self.events_since_snapshot.get(game_id, 0) + 1
+            if game_info is not None and count >= self.snapshot_every:
+                self.pending.append(('snapshot', game_id, pickle.dumps(game_info)))
+                count = 0
+            self.events_since_snapshot[game_id] = count
+            self.condition.notify()
+
+    def snapshot(self, game_id, game_info):
+        with self.condition:
+            self.pending.append(('snapshot', game_id, pickle.dumps(game_info)))
+            self.events_since_snapshot[game_id] = 0
+            self.condition.notify()
+
+    def drop(self, game_id):
+        with self.condition:
+            self.pending.append(('drop', game_id))
+            self.events_since_snapshot.pop(game_id, None)
+            self.condition.notify()
+
+    def _writer_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.pending:
+                    return
+            # Let a batch accumulate so many requests share one commit
+            if not self.closed:
+                time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            self._write_batch()
+
+    def _write_batch(self):
+        with self.condition:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN")
+        for row in batch:
+            if row[0] == 'event':
+                cursor.execute(
+                    "INSERT INTO events (game_id, kind, payload, at) VALUES (?, ?, ?, ?)", row[1:])
+            elif row[0] == 'snapshot':
+                game_id = row[1]
+                seq = cursor.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM events WHERE game_id = ?", (game_id,)).fetchone()[0]
+                cursor.execute(
+                    "INSERT OR REPLACE INTO snapshots (game_id, seq, data) VALUES (?, ?, ?)",
+                    (game_id, seq, row[2]))
+                # Events covered by the snapshot are never replayed again
+                cursor.execute("DELETE FROM events WHERE game_id = ? AND seq <= ?", (game_id, seq))
+            elif row[0] == 'drop':
+                cursor.execute("DELETE FROM events WHERE game_id = ?", (row[1],))
+                cursor.execute("DELETE FROM snapshots WHERE game_id = ?", (row[1],))
+        cursor.execute("COMMIT")
+
+    def restore(self):
+        self.flush()
+        games = {}
+        for game_id, data in self.conn.execute("SELECT game_id, data FROM snapshots"):
+            games[game_id] = pickle.loads(data)
+
+        rows = self.conn.execute("""
+            SELECT e.game_id, e.kind, e.payload, e.at FROM events e
+            LEFT JOIN snapshots s ON e.game_id = s.game_id
+            WHERE s.seq IS NULL OR e.seq > s.seq
+            ORDER BY e.seq
+        """)
+        for game_id, kind, payload, at in rows:
+            apply_event(games, game_id, kind, json.loads(payload))
+            games[game_id]['last_active'] = at
+            self.events_since_snapshot[game_id] = self.events_since_snapshot.get(game_id, 0) + 1
+        return games
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.writer.join()
+        self.flush()
+        self.conn.close()
@@ -1,17 +1,71 @@
+from collections import OrderedDict
 from flask import render_template
+from jinja2 import Environment
+from markupsafe import Markup
+from metrics import Metrics
+import glob
+import os
+import threading
 import markdown
 
-def render_markdown_template(filesname_no_ext, replacements_dict={}):
-    # Read the Markdown content from the file
-    with open('markdown/' + filesname_no_ext + '.md', 'r') as file:
-        md_string = file.read()
+MARKDOWN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'markdown')
+RENDER_CACHE_SIZE = 4096
 
-    # Replace placeholders with values from replacements_dict
-    for key, value in replacements_dict.items():
-        placeholder = f"{{{{ {key} }}}}"
-        md_string = md_string.replace(placeholder, value)
+_jinja_env = Environment(autoescape=True)
 
-    # Convert the modified Markdown to HTML
-    html_content = markdown.markdown(md_string)
-    return render_template('general_markdown' + '.html', content=html_content)
+def compile_markdown_templates(markdown_dir=MARKDOWN_DIR):
+    # Markdown shape never changes, so convert each file to HTML once and keep
+    # the {{ placeholders }} as Jinja expressions to be filled in per request
+    compiled = {}
+    for path in glob.glob(os.path.join(markdown_dir, '*.md')):
+        with open(path, 'r') as file:
+            html_content = markdown.markdown(file.read())
+        name = os.path.splitext(os.path.basename(path))[0]
+        compiled[name] = _jinja_env.from_string(html_content)
+    return compiled
 
+markdown_templates = compile_markdown_templates()
+
+class LRUCache:
+    def __init__(self, maxsize=RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+# Rendered pages keyed by (game_id, player_name, game state version)
+render_cache = LRUCache()
+
+# Request and phase timings for the /metrics endpoint
+metrics = Metrics()
+
+def render_markdown_template(filesname_no_ext, replacements_dict={}, updates_url=None):
+    with metrics.phase('markdown'):
+        html_content = markdown_templates[filesname_no_ext].render(replacements_dict)
+    with metrics.phase('template'):
+        return render_template('general_markdown' + '.html', content=Markup(html_content), updates_url=updates_url)
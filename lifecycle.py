@@ -0,0 +1,155 @@
+from AvalonGame import DEFAULT_CHARACTERS, FAILS_REQUIRED_LARGE, FAILS_REQUIRED_SMALL, MISSION_PARTICIPANTS
+from enum import Enum
+from state_backends import MemoryBackend
+import os
+import sys
+import threading
+import time
+import traceback
+
+HOUR = 60 * 60
+# Ended games can be replayed from the archive, so they needn't stay in memory long
+ENDED_TTL = 2 * HOUR
+LOBBY_TTL = 72 * HOUR
+IDLE_TTL = 6 * HOUR
+SWEEP_INTERVAL = 10 * 60
+SPILL_DIR = 'spill'
+
+# Tables every game points at; they don't count towards any one game's memory
+SHARED_OBJECTS = frozenset(id(table) for table in [
+    FAILS_REQUIRED_SMALL, FAILS_REQUIRED_LARGE,
+    *MISSION_PARTICIPANTS.values(), *DEFAULT_CHARACTERS.values()
+])
+
+def touch(game_info):
+    game_info['last_active'] = time.time()
+
+def now_idle(game_info):
+    now = time.time()
+    return now - game_info.get('last_active', now)
+
+def game_memory(obj, seen=None):
+    # Rough deep size in bytes of a game entry and everything it references
+    if seen is None:
+        seen = set(SHARED_OBJECTS)
+    if id(obj) in seen or isinstance(obj, Enum):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(game_memory(k, seen) + game_memory(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(game_memory(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += game_memory(vars(obj), seen)
+    elif hasattr(type(obj), '__slots__'):
+        size += sum(game_memory(getattr(obj, name), seen) for name in type(obj).__slots__ if hasattr(obj, name))
+    return size
+
+class GameLifecycle:
+    def __init__(self, games, store, archive, lobbies, ended_ttl=ENDED_TTL, lobby_ttl=LOBBY_TTL, idle_ttl=IDLE_TTL,
+                 sweep_interval=SWEEP_INTERVAL, spill_dir=SPILL_DIR):
+        self.games = games
+        self.store = store
+        self.ended_ttl = ended_ttl
+        self.lobby_ttl = lobby_ttl
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.archive = archive
+        self.lobbies = lobbies
+        self.spill_dir = spill_dir
+        # Per-game memory in bytes as of the last sweep. Only memory:// games live in
+        # this process; the others would be measured on freshly unpickled copies.
+        self.memory = {}
+        self.thread = None
+
+    def start(self):
+        # Sweeps run in a background thread, so no request ever waits on one
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                # A backend error must not end the thread and stop every later sweep
+                print("sweeping games failed:", file=sys.stderr)
+                traceback.print_exc()
+
+    def sweep(self):
+        now = time.time()
+        memory = {}
+        for game_id, game_info in self.games.items():
+            try:
+                if self._sweep_game(game_id, game_info, now) and isinstance(self.games, MemoryBackend):
+                    memory[game_id] = self._measure(game_id)
+            except Exception:
+                # One game that can't be archived or spilled must not stop the sweep for every other
+                print(f"sweeping game {game_id} failed:", file=sys.stderr)
+                traceback.print_exc()
+        self.memory = memory
+
+    def _sweep_game(self, game_id, game_info, now):
+        # Returns whether the game stays in memory
+        idle = now - game_info.get('last_active', now)
+        this_game = game_info.get('game_object')
+        if this_game is None:
+            if idle > self.lobby_ttl:
+                self._evict(game_id, self._lobby_expired)
+                return False
+        elif this_game.mechanic_mode == "ended":
+            if idle > self.ended_ttl:
+                self._evict(game_id, self._archive)
+                return False
+        elif idle > self.idle_ttl and isinstance(self.games, MemoryBackend):
+            # Spilled games are reloaded transparently on their next request
+            self._spill(game_id)
+            return False
+        return True
+
+    def _measure(self, game_id):
+        # Under the game's lock, as requests change its dicts and lists while we walk them
+        with self.games.locked(game_id) as game_info:
+            return game_memory(game_info) if game_info is not None else 0
+
+    def total_memory(self):
+        return sum(self.memory.values())
+
+    def largest_game_memory(self):
+        return max(self.memory.values(), default=0)
+
+    def _spill(self, game_id):
+        # Under the game's lock, so no request can change the game after it is written out
+        with self.games.locked(game_id) as game_info:
+            if game_info is None or now_idle(game_info) <= self.idle_ttl:
+                return
+            this_game = game_info.get('game_object')
+            if this_game is None or this_game.mechanic_mode == "ended":
+                return
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.games.spill(game_id, os.path.join(self.spill_dir, f"{game_id}.pickle"))
+
+    def _lobby_expired(self, game_id, game_info, now):
+        return game_info.get('game_object') is None and now - game_info.get('last_active', now) > self.lobby_ttl
+
+    def _archive(self, game_id, game_info, now):
+        this_game = game_info.get('game_object')
+        if this_game is None or this_game.mechanic_mode != "ended":
+            return False
+        if now - game_info.get('last_active', now) <= self.ended_ttl:
+            return False
+        self.archive.append(game_id, game_info)
+        return True
+
+    def _evict(self, game_id, should_evict):
+        # Re-check and delete under the game's lock, so a join that was waiting on it
+        # finds the game gone rather than being silently dropped
+        with self.games.locked(game_id) as game_info:
+            if game_info is None or not should_evict(game_id, game_info, time.time()):
+                return
+            self.games.delete(game_id)
+            self.store.drop(game_id)
+            self.lobbies.remove(game_id)
@@ -0,0 +1,199 @@
+from state_backends import RedisBackend, SQLiteBackend
+import heapq
+import json
+import threading
+
+# Stale heap entries are dropped in one pass once they outnumber live lobbies by this much
+COMPACT_SLACK = 64
+
+class BaseLobbyIndex:
+    # Every index is filled the same way from the games already stored
+    def load(self, games):
+        # Anything stale is put right the next time its lobby is locked and updated
+        for game_id, game_info in games:
+            self.update(game_id, game_info)
+
+class LobbyIndex(BaseLobbyIndex):
+    # Open lobbies by number_of_players, so matchmaking and the lobby list never
+    # scan games. Each size has a heap of (-players, game_id): the fullest lobby
+    # is on top. A join pushes a fresh entry rather than fixing the old one, and
+    # entries that no longer match the lobby are skipped once they reach the top.
+    # This one lives in the process, for memory://; joins re-check the lobby under the game's lock.
+    def __init__(self):
+        self.lock = threading.Lock()
+        # game_id -> (number_of_players, players)
+        self.lobbies = {}
+        self.heaps = {}
+
+    def update(self, game_id, game_info):
+        # Call with the game locked, after any change to its players
+        entry = lobby_entry(game_info)
+        with self.lock:
+            if entry is None:
+                self.lobbies.pop(game_id, None)
+                return
+            size, players = entry[0], tuple(entry[1])
+            self.lobbies[game_id] = (size, players)
+            heap = self.heaps.setdefault(size, [])
+            heapq.heappush(heap, (-len(players), game_id))
+            if len(heap) > 2 * len(self.lobbies) + COMPACT_SLACK:
+                self._compact()
+
+    def remove(self, game_id):
+        with self.lock:
+            self.lobbies.pop(game_id, None)
+
+    def _live(self, size, entry):
+        lobby = self.lobbies.get(entry[1])
+        return lobby is not None and lobby[0] == size and len(lobby[1]) == -entry[0]
+
+    def _compact(self):
+        for size, heap in self.heaps.items():
+            live = {entry for entry in heap if self._live(size, entry)}
+            self.heaps[size] = heap = list(live)
+            heapq.heapify(heap)
+
+    def fullest(self, size, username):
+        # Fullest open lobby of this size that username isn't already in, or None
+        with self.lock:
+            heap = self.heaps.get(size, [])
+            skipped = []
+            found = None
+            while heap:
+                entry = heap[0]
+                if not self._live(size, entry):
+                    heapq.heappop(heap)
+                elif username in self.lobbies[entry[1]][1]:
+                    skipped.append(heapq.heappop(heap))
+                else:
+                    found = entry[1]
+                    break
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+            return found
+
+    def open_lobbies(self, size=None):
+        # (game_id, number_of_players, players), fullest first
+        with self.lock:
+            lobbies = [(game_id, lobby_size, list(players)) for game_id, (lobby_size, players) in self.lobbies.items()
+                       if size is None or lobby_size == size]
+        lobbies.sort(key=lambda lobby: (lobby[1] - len(lobby[2]), lobby[0]))
+        return lobbies
+
+def lobby_entry(game_info):
+    # (number_of_players, players) for an open lobby, or None once it has filled or started
+    size = game_info['number_of_players']
+    if game_info.get('game_object') is not None or len(game_info['players']) >= size:
+        return None
+    return size, list(game_info['players'])
+
+class SQLiteLobbyIndex(BaseLobbyIndex):
+    # Open lobbies in a table of the backend's SQLite file, over its connections,
+    # so every worker matches against the same lobbies. The index on
+    # (number_of_players, filled) makes the fullest lobby an index seek.
+    def __init__(self, games):
+        self.games = games
+        self.games.connection().executescript("""
+            CREATE TABLE IF NOT EXISTS lobbies (
+                game_id INTEGER PRIMARY KEY,
+                number_of_players INTEGER NOT NULL,
+                filled INTEGER NOT NULL,
+                players TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS lobbies_fullest ON lobbies (number_of_players, filled DESC, game_id);
+        """)
+
+    def update(self, game_id, game_info):
+        # Call with the game locked, after any change to its players
+        entry = lobby_entry(game_info)
+        if entry is None:
+            self.remove(game_id)
+            return
+        size, players = entry
+        self.games.connection().execute(
+            "INSERT OR REPLACE INTO lobbies (game_id, number_of_players, filled, players) VALUES (?, ?, ?, ?)",
+            (game_id, size, len(players), json.dumps(players)))
+
+    def remove(self, game_id):
+        self.games.connection().execute("DELETE FROM lobbies WHERE game_id = ?", (game_id,))
+
+    def fullest(self, size, username):
+        rows = self.games.connection().execute(
+            "SELECT game_id, players FROM lobbies WHERE number_of_players = ? ORDER BY filled DESC, game_id", (size,))
+        for game_id, players in rows:
+            if username not in json.loads(players):
+                return game_id
+        return None
+
+    def open_lobbies(self, size=None):
+        query = "SELECT game_id, number_of_players, players FROM lobbies"
+        params = ()
+        if size is not None:
+            query += " WHERE number_of_players = ?"
+            params = (size,)
+        rows = self.games.connection().execute(query + " ORDER BY number_of_players - filled, game_id", params)
+        return [(game_id, number_of_players, json.loads(players)) for game_id, number_of_players, players in rows]
+
+class RedisLobbyIndex(BaseLobbyIndex):
+    # Open lobbies in the backend's Redis, over its connections: a sorted set per
+    # size scored by players, ties going to the older id, and a hash of each
+    # lobby's size and players
+    PAGE = 16
+
+    def __init__(self, games):
+        self.games = games
+        self.prefix = games.prefix
+
+    def _sizes_key(self, size):
+        return f"{self.prefix}:lobbies:{size}"
+
+    def update(self, game_id, game_info):
+        # Call with the game locked, after any change to its players
+        entry = lobby_entry(game_info)
+        if entry is None:
+            self.remove(game_id)
+            return
+        size, players = entry
+        conn = self.games.connection()
+        conn.execute('HSET', f"{self.prefix}:lobby", game_id, json.dumps([size, players]))
+        conn.execute('ZADD', self._sizes_key(size), (len(players) << 32) - game_id, game_id)
+
+    def remove(self, game_id):
+        conn = self.games.connection()
+        data = conn.execute('HGET', f"{self.prefix}:lobby", game_id)
+        if data is not None:
+            conn.execute('ZREM', self._sizes_key(json.loads(data)[0]), game_id)
+            conn.execute('HDEL', f"{self.prefix}:lobby", game_id)
+
+    def _lobbies(self, game_ids):
+        if not game_ids:
+            return []
+        entries = self.games.connection().execute('HMGET', f"{self.prefix}:lobby", *game_ids)
+        return [(int(game_id), *json.loads(data)) for game_id, data in zip(game_ids, entries) if data is not None]
+
+    def fullest(self, size, username):
+        conn = self.games.connection()
+        start = 0
+        while True:
+            game_ids = conn.execute('ZREVRANGE', self._sizes_key(size), start, start + self.PAGE - 1)
+            for game_id, _, players in self._lobbies(game_ids):
+                if username not in players:
+                    return game_id
+            if len(game_ids) < self.PAGE:
+                return None
+            start += self.PAGE
+
+    def open_lobbies(self, size=None):
+        lobbies = []
+        for lobby_size in ([size] if size is not None else range(5, 11)):
+            lobbies.extend(self._lobbies(self.games.connection().execute('ZREVRANGE', self._sizes_key(lobby_size), 0, -1)))
+        lobbies.sort(key=lambda lobby: (lobby[1] - len(lobby[2]), lobby[0]))
+        return lobbies
+
+def make_lobby_index(games):
+    # Kept next to the games, so workers sharing a backend share their lobbies too
+    if isinstance(games, SQLiteBackend):
+        return SQLiteLobbyIndex(games)
+    if isinstance(games, RedisBackend):
+        return RedisLobbyIndex(games)
+    return LobbyIndex()
@@ -0,0 +1,191 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, request
+import sys
+import threading
+import time
+
+# Latency buckets in seconds; long-polls and SSE land in the top ones
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0, 30.0)
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP_STACKS = 10
+PROFILE_STACK_DEPTH = 30
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        # One slot per bucket plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+class Metrics:
+    # Per-process counters; with several uWSGI workers each one reports its own
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.phases = {}
+        self.responses = Counter()
+        self.rejections = Counter()
+
+    def observe_route(self, route, status, seconds):
+        with self.lock:
+            histogram = self.routes.get(route)
+            if histogram is None:
+                histogram = self.routes[route] = Histogram()
+            histogram.observe(seconds)
+            self.responses[route, status] += 1
+
+    def observe_phase(self, phase, seconds):
+        with self.lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(name, time.perf_counter() - start)
+
+    def reject(self, route):
+        with self.lock:
+            self.rejections[route] += 1
+
+    def render(self, gauges=()):
+        # Prometheus text exposition format, version 0.0.4
+        with self.lock:
+            routes = {route: (list(h.counts), h.total, h.count) for route, h in self.routes.items()}
+            phases = {phase: (list(h.counts), h.total, h.count) for phase, h in self.phases.items()}
+            responses = dict(self.responses)
+            rejections = dict(self.rejections)
+
+        lines = []
+        render_histogram(lines, 'avalong_request_duration_seconds', 'Time spent handling requests.', 'route', routes)
+        render_histogram(lines, 'avalong_phase_duration_seconds', 'Time spent in each phase of a request.', 'phase', phases)
+        lines.append('# HELP avalong_responses_total Responses sent, by route and status.')
+        lines.append('# TYPE avalong_responses_total counter')
+        for (route, status), count in sorted(responses.items()):
+            lines.append(f'avalong_responses_total{{route="{route}",status="{status}"}} {count}')
+        lines.append('# HELP avalong_limiter_rejections_total Requests refused by the rate limiter.')
+        lines.append('# TYPE avalong_limiter_rejections_total counter')
+        for route, count in sorted(rejections.items()):
+            lines.append(f'avalong_limiter_rejections_total{{route="{route}"}} {count}')
+        for name, kind, help_text, samples in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+def render_histogram(lines, name, help_text, label, series):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for key, (counts, total, count) in sorted(series.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{label}="{key}"}} {total}')
+        lines.append(f'{name}_count{{{label}="{key}"}} {count}')
+
+def games_by_mode(games):
+    modes = Counter()
+    for _, game_info in games.items():
+        this_game = game_info.get("game_object")
+        modes[this_game.mechanic_mode if this_game else "waiting"] += 1
+    return modes
+
+class SlowRequestProfiler:
+    # Samples the stacks of in-flight requests from a background thread and
+    # prints the hottest ones for any request slower than threshold seconds
+    def __init__(self, threshold, interval=PROFILE_INTERVAL, out=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.out = out or sys.stderr
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.busy = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def start(self):
+        with self.lock:
+            self.in_flight[threading.get_ident()] = Counter()
+            self.busy.set()
+
+    def finish(self, route, seconds):
+        with self.lock:
+            samples = self.in_flight.pop(threading.get_ident(), None)
+            if not self.in_flight:
+                self.busy.clear()
+        if samples and seconds >= self.threshold:
+            self.dump(route, seconds, samples)
+
+    def _run(self):
+        while True:
+            self.busy.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, samples in self.in_flight.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[stack_of(frame)] += 1
+
+    def dump(self, route, seconds, samples):
+        total = sum(samples.values())
+        lines = [f"slow request {route}: {seconds * 1000:.1f} ms, {total} samples"]
+        for stack, count in samples.most_common(PROFILE_TOP_STACKS):
+            lines.append(f"  {count / total:6.1%}  " + ' <- '.join(stack))
+        self.out.write('\n'.join(lines) + '\n')
+        self.out.flush()
+
+def stack_of(frame):
+    # Innermost call first, as file:line function
+    stack = []
+    while frame is not None and len(stack) < PROFILE_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno} {code.co_name}")
+        frame = frame.f_back
+    return tuple(stack)
+
+def install_metrics(app, metrics, profiler=None):
+    # Times every request by endpoint; the route label stays bounded because
+    # it comes from the matched rule rather than the raw path
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        if profiler is not None:
+            profiler.start()
+
+    # Run ahead of the limiter's own hook so refused requests are timed as 429s
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+
+    @app.after_request
+    def stop_timer(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            seconds = time.perf_counter() - start
+            route = request.endpoint or 'unmatched'
+            metrics.observe_route(route, response.status_code, seconds)
+            if profiler is not None:
+                profiler.finish(route, seconds)
+        return response
+
+    @app.teardown_request
+    def drop_profile(error):
+        # after_request is skipped when a view raises; don't leave the thread registered
+        if profiler is not None and g.pop('metrics_start', None) is not None:
+            profiler.finish(request.endpoint or 'unmatched', 0.0)
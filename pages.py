@@ -0,0 +1,73 @@
+from flask import Response, request
+import gzip
+import hashlib
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Pages built once at startup get the slowest, smallest settings; per-player
+# pages are compressed on a render-cache miss, so they trade some size for speed
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MIN_COMPRESS_BYTES = 256
+# Brotli first, so it wins a tie
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+STATIC_CACHE_CONTROL = "public, max-age=300"
+# Actions redirect back to the same page URL, so a cached copy must always be
+# revalidated; an unchanged page then costs an empty 304
+PRIVATE_CACHE_CONTROL = "private, max-age=0, must-revalidate"
+
+def compress(body, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(body, 9 if best else GZIP_LEVEL, mtime=0)
+
+class CompressedPage:
+    # A rendered page and its encodings, each compressed once and served to
+    # every matching request. Pages built with best=True compress everything up
+    # front; the rest only compress an encoding the first time a client asks for
+    # it, since most per-player pages are only ever fetched by one browser.
+    __slots__ = ('variants', 'encodings', 'etag', 'last_modified')
+
+    def __init__(self, html, last_modified=None, best=False):
+        body = html.encode()
+        self.variants = {'identity': body}
+        self.encodings = ENCODINGS if len(body) >= MIN_COMPRESS_BYTES else ()
+        if best:
+            for encoding in self.encodings:
+                self.variants[encoding] = compress(body, encoding, best=True)
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.last_modified = int(last_modified or time.time())
+
+    def response(self, cache_control):
+        encoding = negotiate_encoding(self.encodings)
+        if encoding not in self.variants:
+            # Two requests may both compress it; either result is fine to keep
+            self.variants[encoding] = compress(self.variants['identity'], encoding)
+        response = Response(self.variants[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        # Each encoding is a different representation, so it gets its own ETag
+        response.set_etag(f"{self.etag}-{encoding}")
+        response.last_modified = self.last_modified
+        response.headers['Cache-Control'] = cache_control
+        return response.make_conditional(request)
+
+def negotiate_encoding(encodings):
+    # Highest q-value wins, brotli first on a tie; identity if the client takes neither
+    accept = request.accept_encodings
+    best, best_quality = 'identity', 0
+    for encoding in encodings:
+        quality = accept[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def source_mtime(*paths):
+    return max(os.path.getmtime(path) for path in paths)
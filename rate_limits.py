@@ -0,0 +1,137 @@
+from limits.storage import Storage
+from urllib.parse import urlparse
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+# Cheaper policies than the three-window default: one window for static
+# pages, and one bucket shared by every route that changes a game
+STATIC_LIMIT = "20 per second"
+MUTATION_LIMIT = "10 per second;600 per hour"
+# An open game page reconnects its event stream about every 26 seconds for as
+# long as it stays open, so the daily and hourly defaults would cut it off within
+# a day, and a 429 ends an EventSource for good. Live routes get one short window.
+LIVE_LIMIT = "10 per second"
+
+DEFAULT_URI = 'shm://' + os.path.join(tempfile.gettempdir(), 'avalong_limits')
+
+# Slot: key hash, count, expiry timestamp
+SLOT = struct.Struct('<QQd')
+SLOTS_PER_BUCKET = 8
+BUCKETS = 8192
+
+class SharedMemoryStorage(Storage):
+    # Fixed-window counters in an mmap'd file, so every uWSGI worker on the
+    # host shares the same limits. Keys hash to a bucket of a few slots, each
+    # bucket guarded by an fcntl byte-range lock; a full bucket evicts the
+    # slot that expires first. Use as storage_uri="shm:///path/to/file".
+    STORAGE_SCHEME = ["shm"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.path = urlparse(uri).path if uri else urlparse(DEFAULT_URI).path
+        self.bucket_size = SLOT.size * SLOTS_PER_BUCKET
+        size = self.bucket_size * BUCKETS
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Whichever worker gets here first sizes the file; the rest find it done
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+        # fcntl locks are per process, so threads also need their own lock
+        self.thread_lock = threading.Lock()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def _locate(self, key):
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+        # 0 marks an empty slot
+        return digest or 1, (digest % BUCKETS) * self.bucket_size
+
+    def _locked(self, offset, update):
+        with self.thread_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.bucket_size, offset)
+            try:
+                return update()
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.bucket_size, offset)
+
+    def _find(self, key_hash, offset, now):
+        # Returns (slot offset, count, expiry); a missing key comes back with count 0
+        spare, spare_rank = None, None
+        for slot in range(offset, offset + self.bucket_size, SLOT.size):
+            slot_hash, count, expiry = SLOT.unpack_from(self.map, slot)
+            if slot_hash == key_hash:
+                return (slot, count, expiry) if expiry > now else (slot, 0, 0.0)
+            # Empty and expired slots rank first, then whichever expires soonest
+            rank = expiry if slot_hash and expiry > now else 0.0
+            if spare is None or rank < spare_rank:
+                spare, spare_rank = slot, rank
+        return spare, 0, 0.0
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        key_hash, offset = self._locate(key)
+
+        def update():
+            now = time.time()
+            slot, count, expires = self._find(key_hash, offset, now)
+            if count == 0 or elastic_expiry:
+                expires = now + expiry
+            SLOT.pack_into(self.map, slot, key_hash, count + amount, expires)
+            return count + amount
+
+        return self._locked(offset, update)
+
+    def get(self, key):
+        key_hash, offset = self._locate(key)
+        return self._locked(offset, lambda: self._peek(key_hash, offset)[0])
+
+    def get_expiry(self, key):
+        key_hash, offset = self._locate(key)
+        count, expiry = self._locked(offset, lambda: self._peek(key_hash, offset))
+        return expiry if count else time.time()
+
+    def _peek(self, key_hash, offset):
+        now = time.time()
+        for slot in range(offset, offset + self.bucket_size, SLOT.size):
+            slot_hash, count, expiry = SLOT.unpack_from(self.map, slot)
+            if slot_hash == key_hash and expiry > now:
+                return count, expiry
+        return 0, 0.0
+
+    def clear(self, key):
+        key_hash, offset = self._locate(key)
+
+        def update():
+            for slot in range(offset, offset + self.bucket_size, SLOT.size):
+                if SLOT.unpack_from(self.map, slot)[0] == key_hash:
+                    SLOT.pack_into(self.map, slot, 0, 0, 0.0)
+
+        self._locked(offset, update)
+
+    def check(self):
+        return not self.map.closed
+
+    def reset(self):
+        with self.thread_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                live = 0
+                for slot in range(0, len(self.map), SLOT.size):
+                    slot_hash, _, expiry = SLOT.unpack_from(self.map, slot)
+                    live += slot_hash != 0 and expiry > now
+                self.map[:] = bytes(len(self.map))
+                return live
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
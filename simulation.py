@@ -0,0 +1,289 @@
+from AvalonGame import AvalonGame, DEFAULT_CHARACTERS, FAILS_REQUIRED_LARGE, FAILS_REQUIRED_SMALL, GOOD_ROLES, LOG_EVIL_ASSASSINATION, LOG_EVIL_MISSIONS, LOG_EVIL_REJECTIONS, MISSION_PARTICIPANTS, ROLE_BY_NAME, Role, SEED_BITS
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class RandomPolicy:
+    # Bots see only what get_player_known_info tells them
+    def __init__(self, approve_prob=0.5, sabotage_prob=1.0):
+        self.approve_prob = approve_prob
+        self.sabotage_prob = sabotage_prob
+
+    def propose(self, game, player_name, size, rng):
+        return rng.sample(game.players, size)
+
+    def vote(self, game, player_name, rng):
+        return rng.random() < self.approve_prob
+
+    def mission(self, game, player_name, rng):
+        if ROLE_BY_NAME[game.get_player_known_info(player_name)['character']] & GOOD_ROLES:
+            return True
+        return rng.random() >= self.sabotage_prob
+
+    def assassinate(self, game, player_name, rng):
+        known = set(game.get_player_known_info(player_name).get('known_players', []))
+        candidates = [p for p in game.players if p != player_name and p not in known]
+        return rng.choice(candidates or game.players)
+
+class HeuristicPolicy(RandomPolicy):
+    # Good players avoid anyone they know is evil, evil players try to get onto teams
+    def _is_evil(self, game, player_name):
+        return not ROLE_BY_NAME[game.get_player_known_info(player_name)['character']] & GOOD_ROLES
+
+    def _suspects(self, game, player_name):
+        info = game.get_player_known_info(player_name)
+        if info['character'] == "Merlin":
+            return set(info['known_players'])
+        return set()
+
+    def propose(self, game, player_name, size, rng):
+        others = [p for p in game.players if p != player_name]
+        if not self._is_evil(game, player_name):
+            suspects = self._suspects(game, player_name)
+            others = [p for p in others if p not in suspects] + [p for p in others if p in suspects]
+            return [player_name] + rng.sample(others[:max(size - 1, len(others) - len(suspects))], size - 1)
+        return [player_name] + rng.sample(others, size - 1)
+
+    def vote(self, game, player_name, rng):
+        team = game.proposed_team
+        if self._is_evil(game, player_name):
+            known = set(game.get_player_known_info(player_name).get('known_players', []))
+            return player_name in team or bool(known & set(team)) or rng.random() < self.approve_prob
+        if self._suspects(game, player_name) & set(team):
+            return False
+        # Approve anything on the final rejection to avoid losing outright
+        return player_name in team or game.consecutive_rejects >= 4 or rng.random() < self.approve_prob
+
+def play_game(players, roles=None, policies=None, rng=None):
+    # policies maps player name to policy; a single policy is shared by every seat
+    rng = rng or random.Random()
+    if policies is None:
+        policies = RandomPolicy()
+    if not isinstance(policies, dict):
+        policies = {player: policies for player in players}
+
+    # The deal comes from rng too, so a seeded rng replays the same game
+    game = AvalonGame(players, roles, rng.getrandbits(SEED_BITS))
+    while game.mechanic_mode != "ended":
+        if game.mechanic_mode == "proposal":
+            leader = game.turn_order[game.current_turn]
+            size = game.mission_participants[len(game.completed_missions)]
+            game.propose_team(leader, policies[leader].propose(game, leader, size, rng))
+        elif game.mechanic_mode == "voting":
+            for player in game.players:
+                game.player_vote(player, policies[player].vote(game, player, rng))
+                if game.mechanic_mode != "voting":
+                    break
+        elif game.mechanic_mode == "mission":
+            for player in list(game.proposed_team):
+                game.player_mission_act(player, policies[player].mission(game, player, rng))
+        elif game.mechanic_mode == "assassination":
+            assassin = game.players[game.roles.index(Role.ASSASSIN)]
+            game.assassination(assassin, policies[assassin].assassinate(game, assassin, rng))
+    return game
+
+ENDING_REASONS = {
+    LOG_EVIL_REJECTIONS: "rejections",
+    LOG_EVIL_ASSASSINATION: "assassination",
+    LOG_EVIL_MISSIONS: "missions"
+}
+
+def ending_reason(game):
+    last = game.log[-1].kind
+    if last in ENDING_REASONS:
+        return ENDING_REASONS[last]
+    # Good won, either outright or because the assassin missed
+    return "missions" if "Assassin" not in game.characters else "assassination_missed"
+
+def empty_stats(num_players, roles):
+    return {
+        "num_players": num_players,
+        "roles": list(roles) if roles is not None else list(DEFAULT_CHARACTERS[num_players]),
+        "games": 0,
+        "good_wins": 0,
+        "evil_wins": 0,
+        "reasons": {}
+    }
+
+def merge_stats(total, part):
+    total["games"] += part["games"]
+    total["good_wins"] += part["good_wins"]
+    total["evil_wins"] += part["evil_wins"]
+    for reason, count in part["reasons"].items():
+        total["reasons"][reason] = total["reasons"].get(reason, 0) + count
+    return total
+
+def finish_stats(stats):
+    stats["good_win_rate"] = stats["good_wins"] / stats["games"] if stats["games"] else 0.0
+    return stats
+
+def simulate(num_players, roles=None, games=1000, policy=None, seed=None):
+    rng = random.Random(seed)
+    players = [f"P{i}" for i in range(num_players)]
+    stats = empty_stats(num_players, roles)
+    for _ in range(games):
+        game = play_game(players, roles, policy, rng)
+        stats["games"] += 1
+        stats[f"{game.winner}_wins"] += 1
+        reason = ending_reason(game)
+        stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+    return stats
+
+class RandomBatchPolicy:
+    # Vectorised policy: every method decides for all games at once
+    def __init__(self, approve_prob=0.5, sabotage_prob=1.0):
+        self.approve_prob = approve_prob
+        self.sabotage_prob = sabotage_prob
+
+    def propose(self, state, sizes, rng):
+        # Pick sizes[g] distinct random seats per game by ranking random keys
+        keys = rng.random(state.roles.shape)
+        ranks = keys.argsort(axis=1).argsort(axis=1)
+        return ranks < sizes[:, None]
+
+    def vote(self, state, team, rng):
+        return rng.random(state.roles.shape) < self.approve_prob
+
+    def sabotage(self, state, team, rng):
+        return rng.random(state.roles.shape) < self.sabotage_prob
+
+    def assassinate(self, state, rng):
+        # Random seat that isn't the assassin's own or a known evil teammate
+        keys = rng.random(state.roles.shape)
+        keys[state.evil & ((state.roles & int(Role.OBERON)) == 0)] = -1.0
+        return keys.argmax(axis=1)
+
+class BatchState:
+    # Array-encoded state for many games with the same player count and roles
+    def __init__(self, num_players, roles, games, rng):
+        characters = roles if roles is not None else DEFAULT_CHARACTERS[num_players]
+        role_row = np.array([int(ROLE_BY_NAME[c]) for c in characters], dtype=np.int16)
+        order = rng.random((games, num_players)).argsort(axis=1)
+        self.roles = role_row[order]
+        self.evil = (self.roles & int(GOOD_ROLES)) == 0
+        self.merlin = self.roles == int(Role.MERLIN)
+        self.has_assassin = (self.roles == int(Role.ASSASSIN)).any(axis=1)
+        self.leader = np.zeros(games, dtype=np.int8)
+        self.mission = np.zeros(games, dtype=np.int8)
+        self.successes = np.zeros(games, dtype=np.int8)
+        self.failures = np.zeros(games, dtype=np.int8)
+        self.rejects = np.zeros(games, dtype=np.int8)
+        self.done = np.zeros(games, dtype=bool)
+        self.good_won = np.zeros(games, dtype=bool)
+        self.reason = np.zeros(games, dtype=np.int8)
+
+BATCH_REASONS = {1: "rejections", 2: "missions", 3: "assassination", 4: "assassination_missed"}
+
+def simulate_batch(num_players, roles=None, games=10000, policy=None, seed=None):
+    if np is None:
+        raise ValueError("Batch simulation requires numpy.")
+    rng = np.random.default_rng(seed)
+    policy = policy or RandomBatchPolicy()
+    state = BatchState(num_players, roles, games, rng)
+    sizes_table = np.array(MISSION_PARTICIPANTS[num_players], dtype=np.int8)
+    fails_table = np.array(FAILS_REQUIRED_SMALL if num_players <= 6 else FAILS_REQUIRED_LARGE, dtype=np.int8)
+
+    # Each pass is one proposal and vote, plus the mission if it was approved, for every live game
+    while not state.done.all():
+        live = ~state.done
+        # Finished games may sit one past the last mission; their rows are ignored below
+        mission = np.minimum(state.mission, 4)
+        sizes = sizes_table[mission]
+        team = policy.propose(state, sizes, rng)
+        votes = policy.vote(state, team, rng)
+        approved = live & (votes.sum(axis=1) > num_players / 2)
+        rejected = live & ~approved
+
+        # consecutive_rejects is never reset by AvalonGame, so it isn't reset here either
+        state.rejects[rejected] += 1
+        lost = rejected & (state.rejects == 5)
+        state.done[lost] = True
+        state.reason[lost] = 1
+
+        sabotage = policy.sabotage(state, team, rng) & team & state.evil
+        failed = approved & (sabotage.sum(axis=1) >= fails_table[mission])
+        state.failures[failed] += 1
+        state.successes[approved & ~failed] += 1
+        state.mission[approved] += 1
+
+        evil_missions = approved & (state.failures >= 3)
+        state.done[evil_missions] = True
+        state.reason[evil_missions] = 2
+
+        good_missions = approved & (state.successes >= 3)
+        no_assassin = good_missions & ~state.has_assassin
+        state.done[no_assassin] = True
+        state.good_won[no_assassin] = True
+        state.reason[no_assassin] = 2
+
+        assassination = good_missions & state.has_assassin
+        if assassination.any():
+            targets = policy.assassinate(state, rng)
+            hit = assassination & state.merlin[np.arange(games), targets]
+            missed = assassination & ~hit
+            state.done[assassination] = True
+            state.reason[hit] = 3
+            state.good_won[missed] = True
+            state.reason[missed] = 4
+
+        state.leader[live & ~state.done] = (state.leader[live & ~state.done] + 1) % num_players
+
+    stats = empty_stats(num_players, roles)
+    stats["games"] = games
+    stats["good_wins"] = int(state.good_won.sum())
+    stats["evil_wins"] = games - stats["good_wins"]
+    for code, reason in BATCH_REASONS.items():
+        count = int((state.reason == code).sum())
+        if count:
+            stats["reasons"][reason] = count
+    return stats
+
+def _run_shard(args):
+    num_players, roles, games, seed, batch = args
+    if batch:
+        return simulate_batch(num_players, roles, games, seed=seed)
+    return simulate(num_players, roles, games, seed=seed)
+
+def run_sharded(num_players, roles=None, games=100000, workers=None, batch=True, seed=0, shard_size=50000):
+    # Splits games into shards with their own seeds and merges the per-shard counts
+    workers = workers or os.cpu_count() or 1
+    shards = []
+    remaining = games
+    while remaining > 0:
+        count = min(shard_size, remaining)
+        shards.append((num_players, roles, count, seed + len(shards), batch))
+        remaining -= count
+    total = empty_stats(num_players, roles)
+    if workers == 1:
+        results = map(_run_shard, shards)
+        for part in results:
+            merge_stats(total, part)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for part in pool.map(_run_shard, shards):
+                merge_stats(total, part)
+    return finish_stats(total)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate Avalon games with bot players and report win rates.")
+    parser.add_argument('--players', type=int, nargs='+', default=[5, 6, 7, 8, 9, 10])
+    parser.add_argument('--roles', help="Comma separated roles, e.g. Merlin,Assassin,Knight,Knight,Morgana")
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--objects', action='store_true', help="Drive AvalonGame objects instead of the numpy batch engine")
+    args = parser.parse_args()
+
+    roles = args.roles.split(',') if args.roles else None
+    for num_players in args.players:
+        if roles is not None and len(roles) != num_players:
+            continue
+        stats = run_sharded(num_players, roles, args.games, args.workers, not args.objects, args.seed)
+        print(json.dumps(stats))
@@ -0,0 +1,356 @@
+from AvalonGame import AvalonGame
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import fcntl
+import heapq
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+LOCK_TIMEOUT = 5.0
+# Deletes a Redis lock only if it still holds our token, in one step on the server
+RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+def deleted_while_locked(local):
+    # Game ids this thread deleted inside locked(), which must not be written back
+    deleted = getattr(local, 'deleted', None)
+    if deleted is None:
+        deleted = local.deleted = set()
+    return deleted
+
+class SpilledGame:
+    # Stands in for an idle game that was pickled to disk to free memory
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+class ReplayableGame:
+    # What a spilled game keeps of its AvalonGame when the seed and actions can rebuild it
+    __slots__ = ('seed', 'players', 'characters', 'actions', 'version')
+
+    def __init__(self, this_game):
+        self.seed = this_game.seed
+        self.players = this_game.players
+        self.characters = this_game.characters
+        self.actions = bytes(this_game.actions)
+        self.version = this_game.version
+
+    def rebuild(self):
+        this_game = AvalonGame.replay(self.seed, self.players, self.characters, self.actions)
+        # Changed votes are recorded once, so replay counts fewer versions than the game went through;
+        # pages are cached by version, which must never go back
+        this_game.version = self.version
+        return this_game
+
+class MemoryBackend:
+    # Single process only: games live in this worker's dict
+    def __init__(self, games=None):
+        self.games = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        # Freed ids are reused lowest first; next_id is one past the highest ever used
+        self.free_ids = []
+        self.next_id = 1
+        if games:
+            self.load(games)
+
+    def load(self, games):
+        self.games.update(games)
+        self.next_id = max(self.games, default=0) + 1
+        self.free_ids = [game_id for game_id in range(1, self.next_id) if game_id not in self.games]
+        heapq.heapify(self.free_ids)
+
+    def get(self, game_id):
+        game_info = self.games.get(game_id)
+        if isinstance(game_info, SpilledGame):
+            game_info = self._unspill(game_id)
+        return game_info
+
+    def __contains__(self, game_id):
+        return game_id in self.games
+
+    def put(self, game_id, game_info):
+        self.games[game_id] = game_info
+
+    def delete(self, game_id):
+        with self.locks_lock:
+            # The game's lock stays: threads may still be waiting on it, and they must
+            # exclude whoever locks the game that reuses this id
+            game_info = self.games.pop(game_id, None)
+            if game_info is not None:
+                heapq.heappush(self.free_ids, game_id)
+        if isinstance(game_info, SpilledGame) and os.path.exists(game_info.path):
+            os.remove(game_info.path)
+
+    def items(self):
+        return [(game_id, game_info) for game_id, game_info in list(self.games.items())
+                if not isinstance(game_info, SpilledGame)]
+
+    def create(self, game_info):
+        with self.locks_lock:
+            if self.free_ids:
+                game_id = heapq.heappop(self.free_ids)
+            else:
+                game_id = self.next_id
+                self.next_id += 1
+            self.games[game_id] = game_info
+        return game_id
+
+    def spill(self, game_id, path):
+        game_info = self.games[game_id]
+        this_game = game_info.get('game_object')
+        if this_game is not None and this_game.seed is not None and this_game.actions is not None:
+            game_info = dict(game_info, game_object=ReplayableGame(this_game))
+        with open(path, 'wb') as file:
+            pickle.dump(game_info, file)
+        self.games[game_id] = SpilledGame(path)
+
+    def _unspill(self, game_id):
+        with self.locks_lock:
+            game_info = self.games.get(game_id)
+            if isinstance(game_info, SpilledGame):
+                with open(game_info.path, 'rb') as file:
+                    loaded = pickle.load(file)
+                if isinstance(loaded.get('game_object'), ReplayableGame):
+                    loaded['game_object'] = loaded['game_object'].rebuild()
+                os.remove(game_info.path)
+                self.games[game_id] = game_info = loaded
+        return game_info
+
+    def _lock_for(self, game_id):
+        with self.locks_lock:
+            return self.locks.setdefault(game_id, threading.Lock())
+
+    @contextmanager
+    def locked(self, game_id):
+        with self._lock_for(game_id):
+            yield self.get(game_id)
+
+class SQLiteBackend:
+    # Shared between worker processes on one host through a SQLite file
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.thread_locks = {}
+        self.thread_locks_lock = threading.Lock()
+        # One byte per game id in this file serves as a cross-process lock
+        self.lock_file = open(path + '.lock', 'a+b')
+        self.connection().executescript("""
+            CREATE TABLE IF NOT EXISTS games (
+                game_id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS free_ids (
+                game_id INTEGER PRIMARY KEY
+            );
+        """)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=LOCK_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, game_id):
+        row = self.connection().execute("SELECT data FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def __contains__(self, game_id):
+        return self.connection().execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is not None
+
+    def put(self, game_id, game_info):
+        self.connection().execute(
+            "INSERT OR REPLACE INTO games (game_id, data) VALUES (?, ?)", (game_id, pickle.dumps(game_info)))
+
+    def delete(self, game_id):
+        # Safe inside locked(game_id): the game is not written back afterwards
+        deleted_while_locked(self.local).add(game_id)
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,)).rowcount:
+            conn.execute("INSERT OR IGNORE INTO free_ids (game_id) VALUES (?)", (game_id,))
+        conn.execute("COMMIT")
+
+    def items(self):
+        return [(game_id, pickle.loads(data)) for game_id, data in self.connection().execute("SELECT game_id, data FROM games")]
+
+    def create(self, game_info):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Both lookups are primary key index seeks
+            game_id = conn.execute("SELECT MIN(game_id) FROM free_ids").fetchone()[0]
+            if game_id is None:
+                game_id = conn.execute("SELECT COALESCE(MAX(game_id), 0) + 1 FROM games").fetchone()[0]
+            else:
+                conn.execute("DELETE FROM free_ids WHERE game_id = ?", (game_id,))
+            conn.execute("INSERT INTO games (game_id, data) VALUES (?, ?)", (game_id, pickle.dumps(game_info)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return game_id
+
+    def _thread_lock_for(self, game_id):
+        with self.thread_locks_lock:
+            return self.thread_locks.setdefault(game_id, threading.Lock())
+
+    @contextmanager
+    def locked(self, game_id):
+        # fcntl locks are per process, so threads also take an in-process lock
+        with self._thread_lock_for(game_id):
+            fcntl.lockf(self.lock_file, fcntl.LOCK_EX, 1, game_id)
+            deleted = deleted_while_locked(self.local)
+            deleted.discard(game_id)
+            try:
+                game_info = self.get(game_id)
+                yield game_info
+                if game_info is not None and game_id not in deleted:
+                    self.put(game_id, game_info)
+            finally:
+                deleted.discard(game_id)
+                fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, game_id)
+
+class RedisConnection:
+    # Just enough of the RESP protocol for the commands used below
+    def __init__(self, host, port, db=0):
+        self.sock = socket.create_connection((host, port))
+        self.reader = self.sock.makefile('rb')
+        if db:
+            self.execute('SELECT', db)
+
+    def execute(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b'+':
+            return body.decode()
+        if prefix == b'-':
+            raise ValueError(body.decode())
+        if prefix == b':':
+            return int(body)
+        if prefix == b'$':
+            length = int(body)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if prefix == b'*':
+            length = int(body)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ValueError(f"Unexpected Redis reply {line!r}")
+
+class RedisBackend:
+    # Works with Redis or anything speaking its protocol (e.g. a local stand-in)
+    def __init__(self, host='127.0.0.1', port=6379, db=0, prefix='avalong'):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = RedisConnection(self.host, self.port, self.db)
+            self.local.conn = conn
+        return conn
+
+    def _key(self, game_id):
+        return f"{self.prefix}:game:{game_id}"
+
+    def get(self, game_id):
+        data = self.connection().execute('GET', self._key(game_id))
+        return pickle.loads(data) if data is not None else None
+
+    def __contains__(self, game_id):
+        return self.connection().execute('EXISTS', self._key(game_id)) == 1
+
+    def put(self, game_id, game_info):
+        self.connection().execute('SET', self._key(game_id), pickle.dumps(game_info))
+
+    def delete(self, game_id):
+        # Safe inside locked(game_id): the game is not written back afterwards
+        deleted_while_locked(self.local).add(game_id)
+        conn = self.connection()
+        if conn.execute('DEL', self._key(game_id)):
+            conn.execute('ZADD', f"{self.prefix}:free_ids", game_id, game_id)
+
+    def items(self):
+        conn = self.connection()
+        result = []
+        cursor = b'0'
+        while True:
+            cursor, keys = conn.execute('SCAN', cursor, 'MATCH', f"{self.prefix}:game:*", 'COUNT', 1000)
+            for key in keys:
+                data = conn.execute('GET', key)
+                if data is not None:
+                    result.append((int(key.rsplit(b':', 1)[1]), pickle.loads(data)))
+            if cursor == b'0':
+                return result
+
+    def create(self, game_info):
+        conn = self.connection()
+        while True:
+            popped = conn.execute('ZPOPMIN', f"{self.prefix}:free_ids")
+            if popped:
+                game_id = int(popped[0])
+            else:
+                game_id = conn.execute('INCR', f"{self.prefix}:next_id")
+            if conn.execute('SET', self._key(game_id), pickle.dumps(game_info), 'NX') == 'OK':
+                return game_id
+
+    @contextmanager
+    def locked(self, game_id):
+        conn = self.connection()
+        lock_key = f"{self.prefix}:lock:{game_id}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while conn.execute('SET', lock_key, token, 'NX', 'PX', int(LOCK_TIMEOUT * 1000)) != 'OK':
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Could not lock game {game_id}")
+            time.sleep(0.002)
+        deleted = deleted_while_locked(self.local)
+        deleted.discard(game_id)
+        try:
+            game_info = self.get(game_id)
+            yield game_info
+            if game_info is not None and game_id not in deleted:
+                self.put(game_id, game_info)
+        finally:
+            deleted.discard(game_id)
+            # Had the lock expired, another worker may hold it now, so a GET then DEL
+            # could delete their lock between the two calls
+            conn.execute('EVAL', RELEASE_SCRIPT, 1, lock_key, token)
+
+def make_backend(uri):
+    parsed = urlparse(uri)
+    if parsed.scheme == 'memory':
+        return MemoryBackend()
+    if parsed.scheme == 'sqlite':
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteBackend(parsed.path[1:] or 'avalong_state.db')
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisBackend(parsed.hostname or '127.0.0.1', parsed.port or 6379, db)
+    raise ValueError(f"Unknown state backend {uri}")
@@ -0,0 +1,21 @@
+import os
+import pytest
+import sys
+import tempfile
+
+# The modules live at the top of the repo rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py opens its event log, archive and rate-limit storage on import, so keep them out of the checkout
+SCRATCH = tempfile.mkdtemp(prefix='avalong-tests-')
+os.environ['AVALONG_DB'] = os.path.join(SCRATCH, 'avalong.db')
+os.environ['AVALONG_ARCHIVE'] = os.path.join(SCRATCH, 'avalong_archive.bin')
+os.environ['AVALONG_LIMITS'] = 'memory://'
+os.environ.pop('AVALONG_STATE', None)
+
+@pytest.fixture
+def redis_stand_in():
+    from redis_stand_in import RedisStandIn
+    stand_in = RedisStandIn()
+    yield stand_in
+    stand_in.close()
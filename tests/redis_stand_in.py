@@ -0,0 +1,141 @@
+from state_backends import RELEASE_SCRIPT
+import fnmatch
+import socketserver
+import threading
+import time
+
+class RedisStandIn:
+    # Just enough of a Redis server, in this process, for the commands the
+    # backends and lobby index send. EVAL only knows the lock release script.
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        # Every command received, in order
+        self.commands = []
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RESPHandler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _live(self, key):
+        if key in self.expires and self.expires[key] <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def execute(self, command, *args):
+        with self.lock:
+            self.commands.append((command.upper(),) + args)
+            return getattr(self, command.lower())(*args)
+
+    def select(self, db):
+        return 'OK'
+
+    def get(self, key):
+        return self.data[key] if self._live(key) else None
+
+    def set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        if b'NX' in options and self._live(key):
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if b'PX' in options:
+            self.expires[key] = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+        return 'OK'
+
+    def delete(self, key):
+        live = self._live(key)
+        self.data.pop(key, None)
+        self.expires.pop(key, None)
+        return int(live)
+
+    def exists(self, key):
+        return int(self._live(key))
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+    def scan(self, cursor, match, pattern, *count):
+        keys = [key for key in list(self.data) if self._live(key) and isinstance(self.data[key], bytes)
+                and fnmatch.fnmatchcase(key.decode(), pattern.decode())]
+        return [b'0', keys]
+
+    def eval(self, script, num_keys, key, token):
+        if script.decode() != RELEASE_SCRIPT:
+            raise ValueError("Unknown script")
+        return self.delete(key) if self.get(key) == token else 0
+
+    def zadd(self, key, score, member):
+        scores = self.data.setdefault(key, {})
+        added = member not in scores
+        scores[member] = float(score)
+        return int(added)
+
+    def zrem(self, key, member):
+        return int(self.data.get(key, {}).pop(member, None) is not None)
+
+    def zpopmin(self, key):
+        scores = self.data.get(key, {})
+        if not scores:
+            return []
+        member = min(scores, key=lambda m: (scores[m], m))
+        return [member, str(scores.pop(member)).encode()]
+
+    def zrevrange(self, key, start, stop):
+        scores = self.data.get(key, {})
+        members = sorted(scores, key=lambda m: (-scores[m], m))
+        stop = int(stop)
+        return members[int(start):None if stop == -1 else stop + 1]
+
+    def hset(self, key, field, value):
+        fields = self.data.setdefault(key, {})
+        added = field not in fields
+        fields[field] = value
+        return int(added)
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hdel(self, key, field):
+        return int(self.data.get(key, {}).pop(field, None) is not None)
+
+    def hmget(self, key, *fields):
+        return [self.data.get(key, {}).get(field) for field in fields]
+
+def encode_reply(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'*%d\r\n' % len(value) + b''.join(encode_reply(item) for item in value)
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].decode()
+            try:
+                reply = self.server.stand_in.execute('delete' if command.upper() == 'DEL' else command, *args[1:])
+            except (AttributeError, ValueError) as error:
+                self.wfile.write(b'-ERR %s\r\n' % str(error).encode())
+                continue
+            self.wfile.write(encode_reply(reply))
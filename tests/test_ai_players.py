@@ -0,0 +1,41 @@
+from AvalonGame import ROLE_SIGHT, AvalonGame
+from ai_players import determinize, ismcts, legal_actions, pending_players, sample_roles
+import random
+
+PLAYERS = ["Ann", "Bob", "Cy", "Dee", "Eve", "Fay", "Gus"]
+
+def test_sampled_roles_agree_with_what_each_player_was_told():
+    rng = random.Random(4)
+    for seed in range(20):
+        game = AvalonGame(PLAYERS, seed=seed)
+        for me, player in enumerate(PLAYERS):
+            for _ in range(5):
+                roles = sample_roles(game, player, rng)
+                assert sorted(roles) == sorted(game.roles)
+                assert roles[me] == game.roles[me]
+                known = game.visibility[me]
+                if known is None:
+                    continue
+                sight = ROLE_SIGHT[game.roles[me]]
+                for i, role in enumerate(roles):
+                    if i != me:
+                        assert bool(role & sight) == bool(known >> i & 1)
+
+def test_determinizations_hide_other_players_votes():
+    game = AvalonGame(PLAYERS, seed=2)
+    leader = pending_players(game)[0]
+    game.propose_team(leader, PLAYERS[:2])
+    game.player_vote("Ann", True)
+    game.player_vote("Bob", False)
+    state = determinize(game, "Ann", random.Random(0))
+    assert state.votes == {"Ann": True}
+    assert game.votes == {"Ann": True, "Bob": False}
+    assert state.roles[0] == game.roles[0]
+
+def test_search_picks_a_legal_action():
+    game = AvalonGame(PLAYERS, seed=6)
+    leader = pending_players(game)[0]
+    team = ismcts(game, leader, think_time=5, rng=random.Random(1), max_iterations=50)
+    assert team in legal_actions(game, leader)
+    # The search plays on copies, so the real game hasn't moved
+    assert game.mechanic_mode == "proposal" and game.version == 0
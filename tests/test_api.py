@@ -0,0 +1,71 @@
+from AvalonGame import AvalonGame
+from api import create_api_blueprint
+from flask import Flask
+from state_backends import MemoryBackend
+import pytest
+
+PLAYERS = ["Ann", "Bob", "Cy", "Dee", "Eve"]
+
+@pytest.fixture
+def games():
+    return MemoryBackend()
+
+@pytest.fixture
+def client(games):
+    app = Flask(__name__)
+    app.register_blueprint(create_api_blueprint(games))
+    return app.test_client()
+
+def started(games, created=1.0):
+    return games.create({'number_of_players': 5, 'players': list(PLAYERS), 'created': created,
+                         'game_object': AvalonGame(PLAYERS, seed=8)})
+
+def propose(games, game_id):
+    this_game = games.get(game_id)['game_object']
+    this_game.propose_team(this_game.turn_order[this_game.current_turn], PLAYERS[:2])
+
+def test_unchanged_games_get_an_empty_304(client, games):
+    game_id = started(games)
+    first = client.get(f'/avalom/api/v1/games/{game_id}')
+    assert first.status_code == 200 and first.headers['ETag']
+    again = client.get(f'/avalom/api/v1/games/{game_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    propose(games, game_id)
+    changed = client.get(f'/avalom/api/v1/games/{game_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.get_json()["version"] == 1
+
+def test_a_reused_id_gets_a_new_etag(client, games):
+    game_id = started(games)
+    etag = client.get(f'/avalom/api/v1/games/{game_id}').headers['ETag']
+    games.delete(game_id)
+    assert started(games, created=2.0) == game_id
+    assert client.get(f'/avalom/api/v1/games/{game_id}', headers={'If-None-Match': etag}).status_code == 200
+
+def test_each_player_has_their_own_etag(client, games):
+    game_id = started(games)
+    ann = client.get(f'/avalom/api/v1/games/{game_id}/players/Ann')
+    bob = client.get(f'/avalom/api/v1/games/{game_id}/players/Bob', headers={'If-None-Match': ann.headers['ETag']})
+    assert bob.status_code == 200
+    assert bob.get_json()["known_info"]["character"]
+    assert client.get(f'/avalom/api/v1/games/{game_id}/players/Nobody').status_code == 404
+
+def test_log_windows_and_their_etags(client, games):
+    game_id = started(games)
+    propose(games, game_id)
+    for player in PLAYERS:
+        games.get(game_id)['game_object'].player_vote(player, False)
+    window = client.get(f'/avalom/api/v1/games/{game_id}/log?since=1&limit=5').get_json()
+    assert (window["since"], window["next"], window["total"]) == (1, 2, 2)
+    assert window["log"] == ["rejected by ['Ann', 'Bob', 'Cy', 'Dee', 'Eve']"]
+    tail = client.get(f'/avalom/api/v1/games/{game_id}/log?tail=1')
+    assert tail.get_json()["log"] == window["log"]
+
+    # Later events change the version but not this window, so its ETag still matches
+    etag = client.get(f'/avalom/api/v1/games/{game_id}/log?since=0&limit=2').headers['ETag']
+    propose(games, game_id)
+    games.get(game_id)['game_object'].player_vote("Ann", True)
+    again = client.get(f'/avalom/api/v1/games/{game_id}/log?since=0&limit=2', headers={'If-None-Match': etag})
+    assert again.status_code == 304
@@ -0,0 +1,137 @@
+import app as avalong
+import json
+import pytest
+import threading
+
+PLAYERS = ["Ann", "Bob", "Cy", "Dee", "Eve"]
+
+@pytest.fixture
+def client():
+    avalong.limiter.reset()
+    return avalong.app.test_client()
+
+def started_game(players=PLAYERS):
+    game_id = avalong.open_lobby(players[0], len(players))
+    with avalong.games.locked(game_id) as game_info:
+        avalong.seat_players(game_id, game_info, players[1:])
+    return game_id
+
+def propose(game_id):
+    this_game = avalong.games.get(game_id)['game_object']
+    leader = this_game.turn_order[this_game.current_turn]
+    team = list(this_game.players[:this_game.mission_participants[0]])
+    avalong.perform_action(game_id, 'propose', leader, team)
+
+def test_long_poll_answers_once_the_game_moves(client):
+    game_id = started_game()
+    timer = threading.Timer(0.2, propose, (game_id,))
+    timer.start()
+    response = client.get(f'/avalom/game/{game_id}/Ann/updates?version=0')
+    timer.join()
+    assert response.status_code == 200
+    assert response.get_json()["version"] == 1
+    assert response.get_json()["mechanic_mode"] == "voting"
+
+def test_long_poll_turns_clients_away_when_every_slot_is_waiting(client, monkeypatch):
+    game_id = started_game()
+    monkeypatch.setattr(avalong, 'waiting', threading.BoundedSemaphore(1))
+    avalong.waiting.acquire()
+    response = client.get(f'/avalom/game/{game_id}/Ann/updates?version=0')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(avalong.BUSY_RETRY_SECONDS)
+
+def test_event_stream_resumes_from_the_last_event_id(client):
+    game_id = started_game()
+    propose(game_id)
+    # The header wins over the page's ?version=, which is already current
+    response = client.get(f'/avalom/game/{game_id}/Ann/events?version=1', headers={'Last-Event-ID': '0:0'})
+    events = response.get_data(as_text=True).split('\n\n')
+    assert events[0] == f"retry: {avalong.SSE_RETRY_MS}"
+    event_id, data = events[1].split('\n')
+    assert event_id == "id: 1:1"
+    delta = json.loads(data[len("data: "):])
+    assert delta["mechanic_mode"] == "voting"
+    assert len(delta["log"]) == 1
+
+def test_busy_event_stream_only_sets_a_longer_retry(client, monkeypatch):
+    game_id = started_game()
+    monkeypatch.setattr(avalong, 'waiting', threading.BoundedSemaphore(1))
+    avalong.waiting.acquire()
+    response = client.get(f'/avalom/game/{game_id}/Ann/events?version=0')
+    assert response.get_data(as_text=True) == f"retry: {avalong.BUSY_RETRY_SECONDS * 1000}\n\n"
+
+def test_live_routes_skip_the_default_limits(client):
+    game_id = started_game()
+    # The default allows 8 per second
+    for _ in range(10):
+        assert client.get(f'/avalom/game/{game_id}/Ann/updates').status_code == 200
+
+def test_archived_page_survives_its_id_being_reused(client):
+    from test_avalon_game import played_games
+    finished = next(played_games(1))
+    game_id = avalong.games.create({'number_of_players': len(finished.players), 'players': list(finished.players),
+                                    'game_object': finished, 'created': 1.0, 'last_active': 1.0})
+    avalong.archive.append(game_id, avalong.games.get(game_id))
+    avalong.games.delete(game_id)
+    assert avalong.open_lobby("Ann", 5) == game_id
+
+    response = client.get(f'/avalom/game/{game_id}/{finished.players[0]}')
+    assert response.status_code == 200
+    assert finished.winner in response.get_data(as_text=True)
+    assert client.get(f'/avalom/game/{game_id}/Ann').status_code == 200
+    assert client.get(f'/avalom/game/{game_id}/Nobody').status_code == 404
+
+def leader_and_team(game_id):
+    this_game = avalong.games.get(game_id)['game_object']
+    return this_game.turn_order[this_game.current_turn], list(this_game.players[:this_game.mission_participants[0]])
+
+def test_batch_applies_each_games_actions_together(client):
+    game_id = started_game()
+    leader, team = leader_and_team(game_id)
+    actions = [{"game_id": game_id, "player_name": leader, "kind": "propose", "value": team}]
+    actions += [{"game_id": game_id, "player_name": player, "kind": "vote", "value": True} for player in PLAYERS]
+    response = client.post('/avalom/api/v1/actions', json={"actions": actions})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert all(result["ok"] for result in body["results"])
+    assert body["versions"] == {str(game_id): 6}
+    assert avalong.games.get(game_id)['game_object'].mechanic_mode == "mission"
+
+def test_batch_applies_none_of_a_game_once_one_fails(client):
+    game_id = started_game()
+    leader, team = leader_and_team(game_id)
+    actions = [{"game_id": game_id, "player_name": leader, "kind": "propose", "value": team},
+               {"game_id": game_id, "player_name": "Nobody", "kind": "vote", "value": True}]
+    results = client.post('/avalom/api/v1/actions', json={"actions": actions}).get_json()["results"]
+    assert [result["ok"] for result in results] == [False, False]
+    assert results[1]["error"] == "Player is not part of the game."
+    assert avalong.games.get(game_id)['game_object'].version == 0
+
+def test_batch_keeps_games_apart_and_reports_bad_actions(client):
+    good, sunk = started_game(), started_game()
+    leader, team = leader_and_team(good)
+    actions = [{"game_id": good, "player_name": leader, "kind": "propose", "value": team},
+               {"game_id": sunk, "player_name": "Ann", "kind": "vote", "value": True},
+               {"game_id": sunk, "player_name": "Ann", "kind": "vote", "value": "no"},
+               {"game_id": 10 ** 6, "player_name": "Ann", "kind": "vote", "value": True}]
+    results = client.post('/avalom/api/v1/actions', json={"actions": actions}).get_json()["results"]
+    assert results[0]["ok"]
+    assert results[1]["error"] == "Not applied: another action for this game is malformed."
+    assert results[2]["error"] == "Malformed action."
+    assert results[3]["error"] == "Game not found."
+
+def test_batch_size_is_checked(client):
+    assert client.post('/avalom/api/v1/actions', json={"actions": []}).status_code == 400
+    too_many = [{"game_id": 1, "player_name": "Ann", "kind": "vote", "value": True}] * (avalong.MAX_BATCH_ACTIONS + 1)
+    assert client.post('/avalom/api/v1/actions', json={"actions": too_many}).status_code == 400
+
+def test_game_pages_are_rendered_once_per_version(client):
+    game_id = started_game()
+    avalong.render_cache.clear()
+    misses = avalong.render_cache.misses
+    first = client.get(f'/avalom/game/{game_id}/Ann').data
+    assert client.get(f'/avalom/game/{game_id}/Ann').data == first
+    assert avalong.render_cache.misses == misses + 1
+    propose(game_id)
+    client.get(f'/avalom/game/{game_id}/Ann')
+    assert avalong.render_cache.misses == misses + 2
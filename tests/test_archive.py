@@ -0,0 +1,61 @@
+from archive import Archive, record_json, replay
+from simulation import play_game
+from test_avalon_game import played_games
+import pytest
+
+def archive_games(archive, games):
+    return {archive.append(game_id, {'game_object': game, 'created': 1.0, 'last_active': 2.0}): game
+            for game_id, game in enumerate(games, 1)}
+
+def test_replay_matches_the_archived_game(tmp_path):
+    archive = Archive(str(tmp_path / 'archive.bin'))
+    for offset, game in archive_games(archive, played_games()).items():
+        replayed = replay(archive.load(offset))
+        assert replayed.log == game.log
+        assert replayed.version == game.version
+        assert replayed.get_game_params() == game.get_game_params()
+        assert replayed.get_game_results() == game.get_game_results()
+
+def test_records_resume_from_next(tmp_path):
+    archive = Archive(str(tmp_path / 'archive.bin'))
+    offsets = list(archive_games(archive, played_games(10)))
+    first = list(archive.records(limit=3))
+    assert [offset for offset, _ in first] == offsets[:3]
+    rest = list(archive.records(first[-1][1]["next"]))
+    assert [offset for offset, _ in rest] == offsets[3:]
+    assert record_json(*rest[0])["game_id"] == 4
+
+def test_bad_offsets_are_rejected(tmp_path):
+    archive = Archive(str(tmp_path / 'archive.bin'))
+    offsets = list(archive_games(archive, played_games(3)))
+    with pytest.raises(ValueError):
+        archive.load(offsets[0] + 4)
+    with pytest.raises(ValueError):
+        list(archive.records(offsets[1] - 1))
+
+def test_find_sees_appends_from_another_handle(tmp_path):
+    path = str(tmp_path / 'archive.bin')
+    reader = Archive(path)
+    writer = Archive(path)
+    offset = writer.append(7, {'game_object': next(played_games(1))})
+    assert reader.find(7) == offset
+    assert reader.find(8) is None
+
+def test_find_tells_apart_games_that_shared_an_id(tmp_path):
+    archive = Archive(str(tmp_path / 'archive.bin'))
+    first = play_game(["Ann", "Bob", "Cy", "Dee", "Eve"])
+    second = play_game(["Ann", "Fay", "Gus", "Hal", "Ivy"])
+    first_offset = archive.append(3, {'game_object': first})
+    second_offset = archive.append(3, {'game_object': second})
+    assert archive.find(3) == second_offset
+    assert archive.find(3, "Ann") == second_offset
+    assert archive.find(3, "Bob") == first_offset
+    assert archive.find(3, "Nobody") is None
+
+def test_action_counts_past_16_bits(tmp_path):
+    archive = Archive(str(tmp_path / 'archive.bin'))
+    game = next(played_games(1))
+    game.actions = bytearray(game.actions) * (70001 // (len(game.actions) // 3) + 1)
+    record = archive.load(archive.append(1, {'game_object': game}))
+    assert record["actions"] == bytes(game.actions)
+    assert record["log"] == game.log
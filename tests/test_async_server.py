@@ -0,0 +1,79 @@
+from async_server import OP_TEXT, AsyncServer, encode_frame, read_frame
+from test_app import started_game
+from test_avalon_game import played_games
+import app as avalong
+import asyncio
+import base64
+import http.client
+import json
+import os
+import pytest
+import socket
+import threading
+import time
+
+@pytest.fixture(scope='module')
+def port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = AsyncServer(avalong.app, avalong.games, avalong.perform_action, limiter=avalong.limiter)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete, args=(server.serve('127.0.0.1', port),), daemon=True).start()
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return port
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+def test_responses_without_a_length_are_streamed_in_chunks(port):
+    for game_id, game in enumerate(played_games(3), 1):
+        avalong.archive.append(1000 + game_id, {'game_object': game})
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', '/avalom/api/v1/archive')
+    response = conn.getresponse()
+    assert response.getheader('Transfer-Encoding') == 'chunked'
+    lines = response.read().decode().splitlines()
+    assert [json.loads(line)["game_id"] for line in lines][-3:] == [1001, 1002, 1003]
+    # The connection is still good for the next request
+    conn.request('GET', '/avalom/api/v1/lobbies')
+    assert conn.getresponse().status == 200
+
+def test_oversized_bodies_are_refused(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.putrequest('POST', '/avalom/api/v1/actions')
+    conn.putheader('Content-Length', str(2 << 20))
+    conn.endheaders()
+    assert conn.getresponse().status == 413
+
+def masked(opcode, payload):
+    mask = os.urandom(4)
+    return encode_frame(opcode, b'')[:1] + bytes([0x80 | len(payload)]) + mask + bytes(
+        byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+def test_websocket_actions_are_rate_limited(port):
+    avalong.limiter.reset()
+    game_id = started_game()
+
+    async def send_votes():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write((f"GET /avalom/game/{game_id}/Ann/ws HTTP/1.1\r\nHost: test\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}\r\n\r\n").encode())
+        await reader.readuntil(b'\r\n\r\n')
+        await read_frame(reader)  # the current state
+        replies = []
+        # More than twice the per-second limit, so one window overflows wherever they straddle
+        for _ in range(25):
+            # Nobody has proposed yet, so each vote is refused by the game or the limiter
+            writer.write(masked(OP_TEXT, b'{"kind": "vote", "value": true}'))
+            replies.append(json.loads((await read_frame(reader))[1]))
+        writer.close()
+        return replies
+
+    errors = [reply["error"] for reply in asyncio.run(send_votes())]
+    assert "Rate limit exceeded." in errors
+    assert errors[0] != "Rate limit exceeded."
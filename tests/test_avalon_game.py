@@ -0,0 +1,71 @@
+from AvalonGame import AvalonGame, LogEvent
+from simulation import HeuristicPolicy, play_game
+import pickle
+import random
+
+def played_games(count=200, seed=1):
+    rng = random.Random(seed)
+    for i in range(count):
+        players = [f"P{j}" for j in range(rng.randint(5, 10))]
+        yield play_game(players, policies=HeuristicPolicy() if i % 2 else None, rng=rng)
+
+def game_state(game):
+    return (game.players, game.roles, game.turn_indices, game.log, game.version, game.winner,
+            game.mechanic_mode, game.completed_missions, game.proposed_team, bytes(game.actions), game.seed)
+
+def test_seed_reproduces_the_deal():
+    first = AvalonGame(list("abcdefg"), seed=5)
+    second = AvalonGame(list("abcdefg"), seed=5)
+    assert first.roles == second.roles
+    assert first.turn_indices == second.turn_indices
+
+def test_replay_matches_the_live_game():
+    for game in played_games():
+        replayed = AvalonGame.replay(game.seed, game.players, game.characters, game.actions)
+        assert game_state(replayed) == game_state(game)
+        assert replayed.get_game_results() == game.get_game_results()
+
+def test_replay_mid_game():
+    game = AvalonGame(list("abcdef"), seed=3)
+    leader = game.turn_order[0]
+    game.propose_team(leader, [game.players[3], game.players[1]])
+    game.player_vote(game.players[0], True)
+    replayed = AvalonGame.replay(game.seed, game.players, game.characters, game.actions)
+    assert game_state(replayed) == game_state(game)
+    assert replayed.votes == game.votes
+
+def test_pickle_round_trip():
+    for game in played_games(50):
+        loaded = pickle.loads(pickle.dumps(game))
+        assert game_state(loaded) == game_state(game)
+        assert loaded.log_lines() == game.log_lines()
+        assert all(isinstance(event, LogEvent) for event in loaded.log)
+
+def test_log_windows_only_render_their_own_lines():
+    game = next(played_games(1))
+    loaded = pickle.loads(pickle.dumps(game))
+    # The render cache isn't pickled, so the loaded game starts with nothing rendered
+    assert loaded.log_lines(len(loaded.log) - 2) == game.log_lines()[-2:]
+    assert [line is not None for line in loaded.log_text] == [False] * (len(loaded.log) - 2) + [True] * 2
+    assert loaded.log_lines(0, 2) == game.log_lines()[:2]
+    assert sum(line is not None for line in loaded.log_text) == 4
+    assert loaded.log_lines() == game.log_lines()
+
+def test_setting_the_deal_by_hand_clears_the_seed():
+    game = AvalonGame(list("abcde"), seed=9)
+    game.turn_order = list(reversed(game.turn_order))
+    assert game.seed is None
+
+def test_changed_votes_overwrite_the_recorded_one():
+    game = AvalonGame(list("abcde"), seed=11)
+    leader = game.turn_order[0]
+    game.propose_team(leader, list(game.players[:2]))
+    recorded = len(game.actions)
+    for vote in [True, False] * 1000:
+        game.player_vote("a", vote)
+    assert len(game.actions) == recorded + 3
+    for player in "bcde":
+        game.player_vote(player, True)
+    replayed = AvalonGame.replay(game.seed, game.players, game.characters, game.actions)
+    assert replayed.log == game.log
+    assert replayed.mechanic_mode == game.mechanic_mode == "mission"
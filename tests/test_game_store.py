@@ -0,0 +1,37 @@
+from game_store import GameStore, apply_action
+from test_avalon_game import game_state, played_games
+from AvalonGame import AvalonGame, decode_actions, ACTION_METHODS
+
+KINDS = {'propose_team': 'propose', 'player_vote': 'vote', 'player_mission_act': 'mission', 'assassination': 'assassinate'}
+FIELDS = {'propose': 'team', 'vote': 'vote', 'mission': 'succeed', 'assassinate': 'target'}
+
+def record_game(store, game_id, finished):
+    # Logs the events the app would for a game played to the same end
+    players = list(finished.players)
+    game_info = {'number_of_players': len(players), 'players': [players[0]], 'created': 1.0, 'last_active': 1.0}
+    store.record(game_id, 'create', number_of_players=len(players), username=players[0], created=1.0)
+    for player in players[1:]:
+        game_info['players'].append(player)
+        store.record(game_id, 'join', game_info, username=player)
+    game = AvalonGame(players, finished.characters, finished.seed)
+    game_info['game_object'] = game
+    store.record(game_id, 'start', game_info, players=players, characters=game.characters, seed=game.seed)
+    for kind, player_name, value in decode_actions(game.players, finished.actions):
+        kind = KINDS[ACTION_METHODS[kind]]
+        apply_action(game, kind, player_name, value)
+        store.record(game_id, kind, game_info, player_name=player_name, **{FIELDS[kind]: value})
+    return game_info
+
+def test_restore_after_snapshots(tmp_path):
+    path = str(tmp_path / 'events.db')
+    store = GameStore(path, flush_interval=0, snapshot_every=7)
+    finished = list(played_games(5))
+    for game_id, game in enumerate(finished, 1):
+        record_game(store, game_id, game)
+    store.close()
+
+    restored = GameStore(path).restore()
+    assert sorted(restored) == [1, 2, 3, 4, 5]
+    for game_id, game in enumerate(finished, 1):
+        assert game_state(restored[game_id]['game_object']) == game_state(game)
+        assert restored[game_id]['players'] == list(game.players)
@@ -0,0 +1,16 @@
+from helpers import LRUCache, compile_markdown_templates
+
+def test_lru_cache_drops_the_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert (cache.hits, cache.misses, len(cache)) == (3, 1, 2)
+
+def test_markdown_is_compiled_once_into_templates(tmp_path):
+    (tmp_path / 'greeting.md').write_text("# Hello {{ name }}\n")
+    templates = compile_markdown_templates(str(tmp_path))
+    assert templates['greeting'].render({'name': "<Ann>"}) == "<h1>Hello &lt;Ann&gt;</h1>"
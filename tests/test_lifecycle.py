@@ -0,0 +1,79 @@
+from archive import Archive
+from game_store import GameStore
+from lifecycle import GameLifecycle
+from lobby import LobbyIndex
+from state_backends import MemoryBackend
+from test_avalon_game import played_games
+import pytest
+import time
+
+@pytest.fixture
+def lifecycle(tmp_path):
+    store = GameStore(str(tmp_path / 'events.db'), flush_interval=0)
+    yield GameLifecycle(MemoryBackend(), store, Archive(str(tmp_path / 'archive.bin')), LobbyIndex(),
+                        spill_dir=str(tmp_path / 'spill'))
+    store.close()
+
+def add_ended_game(games, game, last_active=0.0):
+    return games.create({'number_of_players': len(game.players), 'players': list(game.players),
+                         'game_object': game, 'created': 0.0, 'last_active': last_active})
+
+def test_one_failing_game_does_not_stop_the_sweep(lifecycle, monkeypatch):
+    broken, fine = (add_ended_game(lifecycle.games, game) for game in played_games(2))
+    append = lifecycle.archive.append
+
+    def failing_append(game_id, game_info):
+        if game_id == broken:
+            raise OSError("disk full")
+        return append(game_id, game_info)
+
+    monkeypatch.setattr(lifecycle.archive, 'append', failing_append)
+    lifecycle.sweep()
+    assert broken in lifecycle.games
+    assert fine not in lifecycle.games
+    assert lifecycle.archive.find(fine) is not None
+
+def test_spilled_games_keep_their_version(lifecycle, tmp_path):
+    from AvalonGame import AvalonGame
+    game = AvalonGame(list("abcde"), seed=2)
+    game.propose_team(game.turn_order[0], list(game.players[:2]))
+    for vote in (True, False, True):
+        game.player_vote("a", vote)
+    game_id = lifecycle.games.create({'number_of_players': 5, 'players': list("abcde"), 'game_object': game,
+                                      'created': 0.0, 'last_active': 0.0})
+    lifecycle.sweep()
+    assert (tmp_path / 'spill' / f'{game_id}.pickle').exists()
+    restored = lifecycle.games.get(game_id)['game_object']
+    assert restored.version == game.version == 4
+    assert restored.votes == {"a": True}
+
+def test_expired_lobbies_free_their_id_for_the_next_game(lifecycle):
+    games = lifecycle.games
+    stale = games.create({'number_of_players': 5, 'players': ["Ann"], 'created': 0.0, 'last_active': 0.0})
+    fresh = games.create({'number_of_players': 5, 'players': ["Bob"], 'created': 0.0, 'last_active': time.time()})
+    lifecycle.lobbies.load(games.items())
+    lifecycle.sweep()
+    assert stale not in games and fresh in games
+    assert [game_id for game_id, _, _ in lifecycle.lobbies.open_lobbies()] == [fresh]
+    assert games.create({'number_of_players': 5, 'players': ["Cy"]}) == stale
+
+def test_ended_games_are_archived_only_after_their_ttl(lifecycle):
+    recent, old = played_games(2)
+    recent_id = add_ended_game(lifecycle.games, recent, last_active=time.time())
+    old_id = add_ended_game(lifecycle.games, old)
+    lifecycle.sweep()
+    assert recent_id in lifecycle.games and old_id not in lifecycle.games
+    assert lifecycle.archive.find(recent_id) is None
+    assert lifecycle.archive.find(old_id) is not None
+    # Only games still held are measured
+    assert set(lifecycle.memory) == {recent_id}
+    assert lifecycle.total_memory() == lifecycle.largest_game_memory() > 0
+
+def test_a_deleted_game_keeps_its_lock_for_the_id_that_reuses_it(lifecycle):
+    games = lifecycle.games
+    game_id = games.create({'number_of_players': 5, 'players': ["Ann"]})
+    lock = games._lock_for(game_id)
+    with games.locked(game_id):
+        games.delete(game_id)
+    assert games.create({'number_of_players': 5, 'players': ["Bob"]}) == game_id
+    assert games._lock_for(game_id) is lock
@@ -0,0 +1,65 @@
+from lobby import LobbyIndex, RedisLobbyIndex, SQLiteLobbyIndex, make_lobby_index
+from state_backends import MemoryBackend, RedisBackend, SQLiteBackend
+from test_app import client, started_game
+import app as avalong
+import pytest
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def games(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'state.db'))
+    return RedisBackend('127.0.0.1', request.getfixturevalue('redis_stand_in').port)
+
+def lobby(size, *players):
+    return {'number_of_players': size, 'players': list(players)}
+
+def opened(games, lobbies, game_info):
+    game_id = games.create(game_info)
+    lobbies.update(game_id, game_info)
+    return game_id
+
+def test_each_backend_gets_its_own_kind_of_index(games):
+    expected = {MemoryBackend: LobbyIndex, SQLiteBackend: SQLiteLobbyIndex, RedisBackend: RedisLobbyIndex}
+    assert type(make_lobby_index(games)) is expected[type(games)]
+
+def test_fullest_lobby_skips_ones_the_player_is_in(games):
+    lobbies = make_lobby_index(games)
+    small = opened(games, lobbies, lobby(5, "Ann"))
+    full = opened(games, lobbies, lobby(5, "Bob", "Cy", "Dee"))
+    opened(games, lobbies, lobby(6, "Eve", "Fay", "Gus", "Hal"))
+    assert lobbies.fullest(5, "Ann") == full
+    assert lobbies.fullest(5, "Bob") == small
+    assert lobbies.fullest(7, "Ann") is None
+
+    game_info = lobby(5, "Bob", "Cy", "Dee", "Eve", "Fay")
+    lobbies.update(full, game_info)
+    assert lobbies.fullest(5, "Ivy") == small
+    lobbies.remove(small)
+    assert lobbies.fullest(5, "Ivy") is None
+
+def test_open_lobbies_fullest_first(games):
+    lobbies = make_lobby_index(games)
+    first = opened(games, lobbies, lobby(5, "Ann"))
+    second = opened(games, lobbies, lobby(6, "Bob", "Cy", "Dee", "Eve"))
+    third = opened(games, lobbies, lobby(5, "Fay", "Gus"))
+    assert lobbies.open_lobbies() == [(second, 6, ["Bob", "Cy", "Dee", "Eve"]), (third, 5, ["Fay", "Gus"]),
+                                      (first, 5, ["Ann"])]
+    assert [lobby[0] for lobby in lobbies.open_lobbies(5)] == [third, first]
+
+def test_a_new_index_loads_the_stored_lobbies(games):
+    game_id = games.create(lobby(5, "Ann", "Bob"))
+    games.create(dict(lobby(5, "Cy"), game_object=object()))
+    lobbies = make_lobby_index(games)
+    lobbies.load(games.items())
+    assert lobbies.open_lobbies() == [(game_id, 5, ["Ann", "Bob"])]
+
+def test_matchmaking_fills_the_fullest_lobby(client):
+    client.get('/avalom/matchmake?username=Ann&num_players=5')
+    response = client.get('/avalom/matchmake?username=Bob&num_players=5')
+    game_id = int(response.headers['Location'].split('/')[-2])
+    assert avalong.games.get(game_id)['players'] == ["Ann", "Bob"]
+    # Ann is already seated there, so they get a lobby of their own
+    client.get('/avalom/matchmake?username=Ann&num_players=5')
+    assert avalong.games.get(game_id)['players'] == ["Ann", "Bob"]
@@ -0,0 +1,43 @@
+from flask import Flask
+from pages import ENCODINGS, PRIVATE_CACHE_CONTROL, CompressedPage
+import gzip
+import pytest
+
+app = Flask(__name__)
+HTML = "<p>" + "Merlin knows. " * 100 + "</p>"
+
+def serve(page, accept):
+    with app.test_request_context(headers={'Accept-Encoding': accept}):
+        return page.response(PRIVATE_CACHE_CONTROL)
+
+def test_pages_only_compress_the_encoding_asked_for():
+    page = CompressedPage(HTML)
+    assert set(page.variants) == {'identity'}
+    response = serve(page, 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == HTML.encode()
+    assert set(page.variants) == {'identity', 'gzip'}
+    # The next request reuses it
+    compressed = page.variants['gzip']
+    assert serve(page, 'gzip').get_data() == compressed
+
+def test_best_pages_are_compressed_up_front():
+    page = CompressedPage(HTML, best=True)
+    assert set(page.variants) == {'identity', *ENCODINGS}
+
+@pytest.mark.parametrize('accept, expected', [
+    ('gzip;q=1.0, br;q=0.5', 'gzip'),
+    ('br, gzip', 'br' if 'br' in ENCODINGS else 'gzip'),
+    ('deflate', None),
+    ('', None),
+])
+def test_encoding_negotiation(accept, expected):
+    response = serve(CompressedPage(HTML), accept)
+    assert response.headers.get('Content-Encoding') == expected
+    assert response.headers['ETag'].endswith(f'-{expected or "identity"}"')
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+def test_small_pages_are_never_compressed():
+    page = CompressedPage("<p>hi</p>")
+    assert serve(page, 'gzip, br').headers.get('Content-Encoding') is None
+    assert set(page.variants) == {'identity'}
@@ -0,0 +1,28 @@
+from rate_limits import SharedMemoryStorage
+import rate_limits
+
+def test_counts_reset_when_the_window_expires(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limits.time, 'time', lambda: now[0])
+    storage = SharedMemoryStorage(f"shm://{tmp_path / 'limits'}")
+    assert storage.incr('client', 10) == 1
+    assert storage.incr('client', 10) == 2
+    assert storage.get('client') == 2
+    assert storage.get_expiry('client') == 1010.0
+
+    now[0] = 1009.9
+    assert storage.incr('client', 10) == 3
+    now[0] = 1010.1
+    assert storage.get('client') == 0
+    assert storage.incr('client', 10) == 1
+    assert storage.get_expiry('client') == 1020.1
+
+def test_workers_share_counts_through_the_file(tmp_path):
+    uri = f"shm://{tmp_path / 'limits'}"
+    first = SharedMemoryStorage(uri)
+    second = SharedMemoryStorage(uri)
+    first.incr('client', 60)
+    second.incr('client', 60)
+    assert first.get('client') == 2
+    second.clear('client')
+    assert first.get('client') == 0
@@ -0,0 +1,22 @@
+from simulation import run_sharded, simulate, simulate_batch
+
+def test_batch_stats_add_up():
+    stats = simulate_batch(7, games=2000, seed=3)
+    assert stats["games"] == 2000
+    assert stats["good_wins"] + stats["evil_wins"] == 2000
+    assert sum(stats["reasons"].values()) == 2000
+    assert 0 < stats["good_wins"] < 2000
+
+def test_batch_runs_repeat_with_a_seed():
+    assert simulate_batch(5, games=500, seed=9) == simulate_batch(5, games=500, seed=9)
+
+def test_batch_win_rate_is_close_to_the_game_by_game_one():
+    # Same random policy both ways, so the rates only differ by sampling noise
+    batch = simulate_batch(5, games=20000, seed=1)
+    single = simulate(5, games=2000, seed=1)
+    assert abs(batch["good_wins"] / batch["games"] - single["good_wins"] / single["games"]) < 0.05
+
+def test_shards_are_merged():
+    stats = run_sharded(6, games=300, workers=1, seed=2, shard_size=100)
+    assert stats["games"] == 300
+    assert stats["good_win_rate"] == stats["good_wins"] / 300
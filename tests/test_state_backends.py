@@ -0,0 +1,81 @@
+from state_backends import RELEASE_SCRIPT, MemoryBackend, RedisBackend, SQLiteBackend, make_backend
+import pytest
+import threading
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'state.db'))
+    return RedisBackend('127.0.0.1', request.getfixturevalue('redis_stand_in').port)
+
+def lobby(username):
+    return {'number_of_players': 5, 'players': [username]}
+
+def test_freed_ids_are_reused_lowest_first(backend):
+    ids = [backend.create(lobby(name)) for name in "abcd"]
+    assert ids == [1, 2, 3, 4]
+    backend.delete(3)
+    backend.delete(2)
+    assert 2 not in backend and 4 in backend
+    assert backend.create(lobby("e")) == 2
+    assert backend.create(lobby("f")) == 3
+    assert backend.create(lobby("g")) == 5
+    assert sorted(game_id for game_id, _ in backend.items()) == [1, 2, 3, 4, 5]
+
+def test_changes_made_while_locked_are_kept(backend):
+    game_id = backend.create(lobby("a"))
+    with backend.locked(game_id) as game_info:
+        game_info['players'].append("b")
+    assert backend.get(game_id)['players'] == ["a", "b"]
+
+def test_a_game_deleted_while_locked_stays_deleted(backend):
+    game_id = backend.create(lobby("a"))
+    with backend.locked(game_id) as game_info:
+        game_info['players'].append("b")
+        backend.delete(game_id)
+    assert backend.get(game_id) is None
+    assert game_id not in backend
+
+def test_locked_updates_never_race(backend):
+    game_id = backend.create(dict(lobby("a"), count=0))
+
+    def bump():
+        for _ in range(25):
+            with backend.locked(game_id) as game_info:
+                count = game_info['count']
+                # Let the other threads run between the read and the write
+                threading.Event().wait(0.0005)
+                game_info['count'] = count + 1
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.get(game_id)['count'] == 100
+
+def test_redis_release_leaves_a_lock_someone_else_now_holds(redis_stand_in):
+    backend = RedisBackend('127.0.0.1', redis_stand_in.port)
+    game_id = backend.create(lobby("a"))
+    lock_key = f"avalong:lock:{game_id}".encode()
+    with backend.locked(game_id):
+        # Our lock expired and another worker took it
+        redis_stand_in.execute('set', lock_key, b'theirs')
+    # Checking the token and deleting is one command, so the lock can't change hands in between
+    assert redis_stand_in.commands[-1][:3] == ('EVAL', RELEASE_SCRIPT.encode(), b'1')
+    assert redis_stand_in.execute('get', lock_key) == b'theirs'
+    redis_stand_in.execute('delete', lock_key)
+    with backend.locked(game_id):
+        assert redis_stand_in.execute('exists', lock_key) == 1
+    assert redis_stand_in.execute('exists', lock_key) == 0
+
+def test_make_backend_reads_the_uri(tmp_path):
+    assert isinstance(make_backend('memory://'), MemoryBackend)
+    sqlite = make_backend(f"sqlite:///{tmp_path / 'state.db'}")
+    assert isinstance(sqlite, SQLiteBackend) and sqlite.path == str(tmp_path / 'state.db')
+    redis = make_backend('redis://example:6380/2')
+    assert (redis.host, redis.port, redis.db) == ('example', 6380, 2)
+    with pytest.raises(ValueError):
+        make_backend('postgres://localhost')
@@ -0,0 +1,64 @@
+import threading
+import time
+
+POLL_TIMEOUT = 25.0
+# Other workers can't notify us, so waiters also re-read the backend this often
+POLL_INTERVAL = 1.0
+
+_changed = threading.Condition()
+# Callables run on every change, e.g. to wake an asyncio loop from a worker thread
+_listeners = []
+
+def add_change_listener(callback):
+    _listeners.append(callback)
+
+def notify_changed():
+    with _changed:
+        _changed.notify_all()
+    for callback in _listeners:
+        callback()
+
+def wait_for_any_change(timeout=POLL_INTERVAL):
+    with _changed:
+        _changed.wait(timeout)
+
+def state_version(game_info):
+    # Lobbies count up to 0 as players join, then the game's own version takes over
+    this_game = game_info.get("game_object")
+    if this_game is None:
+        return len(game_info['players']) - game_info['number_of_players']
+    return this_game.version
+
+def state_delta(game_info, log_index=0):
+    this_game = game_info.get("game_object")
+    if this_game is None:
+        return {
+            "version": state_version(game_info),
+            "mechanic_mode": "waiting",
+            "players": game_info['players'],
+            "number_of_players": game_info['number_of_players']
+        }
+    return {
+        "version": this_game.version,
+        "mechanic_mode": this_game.mechanic_mode,
+        "current_turn": this_game.turn_order[this_game.current_turn],
+        "proposed_team": this_game.proposed_team,
+        "completed_missions": this_game.completed_missions,
+        "votes_cast": len(this_game.votes),
+        "actions_taken": len(this_game.mission_actions),
+        "log": this_game.log_lines(log_index),
+        "log_index": len(this_game.log)
+    }
+
+def wait_for_change(games, game_id, version, timeout=POLL_TIMEOUT):
+    # Returns the game once its version differs from the one given, or at the timeout
+    deadline = time.monotonic() + timeout
+    while True:
+        game_info = games.get(game_id)
+        if game_info is None or state_version(game_info) != version:
+            return game_info
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return game_info
+        with _changed:
+            _changed.wait(min(remaining, POLL_INTERVAL))